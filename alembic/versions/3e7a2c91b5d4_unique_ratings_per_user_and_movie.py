@@ -0,0 +1,33 @@
+"""Unique rating per user and movie
+
+Revision ID: 3e7a2c91b5d4
+Revises: 8d41c6a9e0f7
+Create Date: 2026-10-18 12:14:52.207316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e7a2c91b5d4'
+down_revision: Union[str, None] = '8d41c6a9e0f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the old read-then-insert path could race and store duplicates.
+    # keep the newest row (highest id) for each (user_id, movie_id)
+    op.execute(
+        "DELETE FROM ratings WHERE id NOT IN ("
+        "SELECT MAX(id) FROM ratings GROUP BY user_id, movie_id)"
+    )
+    op.create_index('ix_ratings_user_id_movie_id', 'ratings', ['user_id', 'movie_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ratings_user_id_movie_id', table_name='ratings')
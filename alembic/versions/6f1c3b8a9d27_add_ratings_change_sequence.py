@@ -0,0 +1,41 @@
+"""Add ratings change sequence
+
+Revision ID: 6f1c3b8a9d27
+Revises: 3e7a2c91b5d4
+Create Date: 2026-10-18 20:41:09.583120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f1c3b8a9d27'
+down_revision: Union[str, None] = '3e7a2c91b5d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    postgres = op.get_bind().dialect.name == "postgresql"
+    if postgres:
+        op.execute(sa.schema.CreateSequence(sa.Sequence('ratings_seq')))
+    op.add_column('ratings', sa.Column('seq', sa.BigInteger(), nullable=True))
+    # existing ratings in insertion order, including the live ones stored
+    # with a NULL timestamp, so the incremental updater picks them all up
+    op.execute("UPDATE ratings SET seq = id")
+    if postgres:
+        op.execute("SELECT setval('ratings_seq', COALESCE((SELECT MAX(seq) FROM ratings), 0) + 1, false)")
+    op.create_index('ix_ratings_seq', 'ratings', ['seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ratings_seq', table_name='ratings')
+    with op.batch_alter_table('ratings') as batch_op:
+        batch_op.drop_column('seq')
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(sa.schema.DropSequence(sa.Sequence('ratings_seq')))
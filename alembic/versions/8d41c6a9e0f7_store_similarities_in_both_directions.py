@@ -0,0 +1,62 @@
+"""Store movie similarities in both directions
+
+Revision ID: 8d41c6a9e0f7
+Revises: 5b2f8e4c1d3a
+Create Date: 2026-10-18 11:03:27.518904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41c6a9e0f7'
+down_revision: Union[str, None] = '5b2f8e4c1d3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('movie_similarities'):
+        op.create_table('movie_similarities',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('neighbor_id', sa.Integer(), nullable=False),
+        sa.Column('weighted_sim', sa.REAL(), nullable=False),
+        sa.PrimaryKeyConstraint('movie_id', 'neighbor_id')
+        )
+        op.create_index('ix_movie_similarities_movie_id_weighted_sim', 'movie_similarities',
+                        ['movie_id', sa.text('weighted_sim DESC')], unique=False)
+        return
+
+    # 8 byte double -> 4 byte real
+    with op.batch_alter_table('movie_similarities') as batch_op:
+        batch_op.alter_column('weighted_sim',
+                              existing_type=sa.Float(),
+                              type_=sa.REAL(),
+                              existing_nullable=False)
+
+    # add the missing direction of every stored pair
+    op.execute("""
+        INSERT INTO movie_similarities (movie_id, neighbor_id, weighted_sim)
+        SELECT s.neighbor_id, s.movie_id, s.weighted_sim
+        FROM movie_similarities s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM movie_similarities r
+            WHERE r.movie_id = s.neighbor_id AND r.neighbor_id = s.movie_id
+        )
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # keep one row per pair, as (smaller id, larger id)
+    op.execute("DELETE FROM movie_similarities WHERE movie_id > neighbor_id")
+    with op.batch_alter_table('movie_similarities') as batch_op:
+        batch_op.alter_column('weighted_sim',
+                              existing_type=sa.REAL(),
+                              type_=sa.Float(),
+                              existing_nullable=False)
@@ -0,0 +1,33 @@
+"""Tag written-back long-tail similarities with the model version
+
+Revision ID: 9b4e2d7c1a56
+Revises: 6f1c3b8a9d27
+Create Date: 2026-10-18 21:07:44.912305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b4e2d7c1a56'
+down_revision: Union[str, None] = '6f1c3b8a9d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing rows are the kNN build's (NULL). untagged long-tail rows an
+    # earlier write-back left behind can't be told apart; the next rebuild
+    # replaces the table
+    op.add_column('movie_similarities', sa.Column('build_version', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM movie_similarities WHERE build_version IS NOT NULL")
+    with op.batch_alter_table('movie_similarities') as batch_op:
+        batch_op.drop_column('build_version')
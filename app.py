@@ -1,11 +1,14 @@
 import time
 import os
+import secrets
 import asyncio
+import logging
+import uuid
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse
 from authlib.integrations.starlette_client import OAuth
 from starlette.config import Config
 from starlette.middleware.sessions import SessionMiddleware
@@ -14,8 +17,15 @@ from jose import jwt
 from recommender.db import get_db, insert_user
 from recommender.models import User
 from recommender.recommender import MovieRecommender
-from schemas import Seeds
-from fastapi import Depends, HTTPException, status
+from recommender.incremental import SIMILARITY_UPDATE_INTERVAL
+from recommender.registry import ModelRegistry, ReloadInProgress
+from recommender.response_cache import ResponseCache, canonical_key
+from recommender.scheduler import Scheduler
+from recommender import workers, metrics
+from recommender.log import setup_logging, debug_sampled, request_id
+from recommender.workers import run_db, run_cpu
+from schemas import Seeds, SeedsBatch
+from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -25,6 +35,10 @@ from jose import jwt, JWTError
 # Load environment variables from a “.env” file 
 config = Config(environ=os.environ)
 
+# JSON logs through a queue, see recommender/log.py for LOG_LEVEL etc.
+setup_logging()
+logger = logging.getLogger("app")
+
 client_id = os.getenv("DEV_GOOGLE_CLIENT_ID")
 client_secret = os.getenv("DEV_GOOGLE_CLIENT_SECRET")
 APP_ENV = os.getenv("APP_ENV")
@@ -47,16 +61,53 @@ JWT_SECRET = config("JWT_SECRET")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRE_SECONDS = 3600
 
-
-# Define app with lifespan recommender
-recommender = None
+# recommendations returned by /recommend
+RECOMMEND_K = int(os.getenv("RECOMMEND_K", "5"))
+# most seed sets accepted by one /recommend/batch call
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "100"))
+# most ratings accepted by one /user/ratings/bulk call
+MAX_BULK_RATINGS = int(os.getenv("MAX_BULK_RATINGS", "1000"))
+# most results returned by /movies/search
+MAX_SEARCH_RESULTS = int(os.getenv("MAX_SEARCH_RESULTS", "50"))
+# shared secret for the /admin endpoints (X-Admin-Token header); unset = disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+# Define app with lifespan recommender.
+# the registry holds the serving model and swaps in reloaded ones
+registry = ModelRegistry()
+# /recommend results by canonical seed set, see recommender/response_cache.py
+responses = ResponseCache.from_env()
+# admission control for /recommend, see recommender/scheduler.py
+scheduler = Scheduler()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global recommender
     loop = asyncio.get_event_loop()
-    recommender = await loop.run_in_executor(None, MovieRecommender)
-    print('Recommender is ready!')
+    await loop.run_in_executor(None, registry.reload)
+    logger.info('Recommender is ready')
+    updates = None
+    if SIMILARITY_UPDATE_INTERVAL > 0:
+        updates = asyncio.create_task(update_similarities())
     yield
+    if updates:
+        updates.cancel()
+    scheduler.shutdown()
+    workers.shutdown()
+
+
+# folds new live ratings into the in-memory model and movie_similarities
+# every SIMILARITY_UPDATE_INTERVAL seconds
+async def update_similarities():
+    while True:
+        await asyncio.sleep(SIMILARITY_UPDATE_INTERVAL)
+        try:
+            # builds an updated copy of the serving model and swaps it in
+            summary = await run_cpu(registry.update)
+            logger.info('Similarity update', extra={"summary": summary})
+        except ReloadInProgress:
+            logger.info('Similarity update skipped, reload in progress')
+        except Exception:
+            logger.exception('Similarity update failed')
 
 app = FastAPI(lifespan=lifespan)
 
@@ -77,6 +128,37 @@ app.add_middleware(
     secret_key=os.getenv("SESSION_SECRET") or "some‐random-string",
 )
 
+# request id for log correlation: the caller's X-Request-ID or a new one,
+# echoed back in the response
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    rid = request.headers.get("x-request-id", "")[:64] or uuid.uuid4().hex
+    token = request_id.set(rid)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = rid
+        return response
+    finally:
+        request_id.reset(token)
+
+
+# request count and latency per route template (not per raw path, so ids in
+# urls and unknown paths don't create new series)
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=path)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=path, status=status_code)
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 url = os.getenv("DATABASE_URL")
@@ -86,9 +168,24 @@ if url.startswith("postgres://"):
     url = url.replace("postgres://", "postgresql://", 1)
 
 
+# the model a request runs against. it is fixed for the whole request,
+# a reload in the meantime doesn't affect it
+def get_model() -> MovieRecommender:
+    model = registry.current()
+    if model is None:
+        raise HTTPException(status_code=503, detail="Recommender is not loaded")
+    return model
+
+
+def verify_admin(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
 def verify_jwt(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        with metrics.STAGE_SECONDS.time(stage="jwt_decode"):
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid JWT payload")
@@ -131,9 +228,8 @@ async def google_callback(
     google_id = user_info["sub"]
     email = user_info["email"]
     name = user_info.get("name", "")
-    print('callback')
-    
-    user = insert_user(session, google_id, email, name)
+    user = await run_db(insert_user, session, google_id, email, name)
+    logger.info('Google login', extra={"user_id": user.id})
 
     # generate a JWT so the frontend can call protected APIs
     expire = int(time.time() + JWT_EXPIRE_SECONDS)
@@ -143,7 +239,6 @@ async def google_callback(
     }
     access_token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
     redirect_url = f"{FRONTEND_URL}/?token={access_token}"
-    print(FRONTEND_URL)
     return RedirectResponse(redirect_url)
 
 
@@ -152,8 +247,10 @@ async def google_callback(
 @app.get("/verify_movie")
 async def verify_movie(
     movie: str,
-    user_id: str = Depends(verify_jwt)
+    user_id: str = Depends(verify_jwt),
+    recommender: MovieRecommender = Depends(get_model)
 ):
+    # a dict lookup, cheap enough to stay on the event loop
     title = recommender.verify_movie_in_db(movie)
     if title != '':
         result = True
@@ -163,46 +260,160 @@ async def verify_movie(
         message = "Movie not found"
     return {"success": result, "detail": message}
 
+# autocomplete / fuzzy search over movie titles
+# results: best matches first, each {"id", "title", "genres"}
+@app.get("/movies/search")
+async def search_movies(
+    q: str,
+    limit: int = 10,
+    user_id: str = Depends(verify_jwt),
+    recommender: MovieRecommender = Depends(get_model)
+):
+    # in-memory index lookups, cheap enough to stay on the event loop
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    return {"results": recommender.search_movies(q, limit)}
+
+
 @app.get("/user/ratings")
 async def get_ratings(
     user_id: str = Depends(verify_jwt),
-    session: Session = Depends(get_db)
+    session: Session = Depends(get_db),
+    recommender: MovieRecommender = Depends(get_model)
 ):
-    ratings = recommender.get_user_ratings(session, user_id)
+    ratings = await run_db(recommender.get_user_ratings, session, user_id)
     success = bool(ratings)
     return {"success": success, "detail": ratings}
 
 
-from schemas import RatingRequest
+from schemas import RatingRequest, BulkRatingRequest
 
 @app.post("/user/ratings")
 async def save_rating(
     rating: RatingRequest,
 
     user_id: str = Depends(verify_jwt),
-    session: Session = Depends(get_db)
+    session: Session = Depends(get_db),
+    recommender: MovieRecommender = Depends(get_model)
 
 ):
-    print('wtf')
-    success = recommender.insert_rating(session, user_id, rating.movie, rating.value)
-    print('success, balls3', success)
+    success = await run_db(recommender.insert_rating, session, user_id, rating.movie, rating.value)
+    debug_sampled(logger, 'Saved rating', user_id=user_id, success=success)
     return {"success": success}
 
 
+@app.post("/user/ratings/bulk")
+async def save_ratings(
+    request: BulkRatingRequest,
+    user_id: str = Depends(verify_jwt),
+    session: Session = Depends(get_db),
+    recommender: MovieRecommender = Depends(get_model)
+):
+    """
+    Save/update many ratings in one call.
+    unknown lists the movies that could not be matched to the catalog.
+    """
+    if len(request.ratings) > MAX_BULK_RATINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BULK_RATINGS} ratings per request"
+        )
+    saved, unknown = await run_db(
+        recommender.insert_ratings,
+        session,
+        user_id,
+        [(r.movie, r.value) for r in request.ratings],
+    )
+    return {"success": saved > 0, "saved": saved, "unknown": unknown}
+
+
 
 @app.post("/recommend")
 async def get_recommendations(
     seeds: Seeds, user_id: str = Depends(verify_jwt),
-    session: Session = Depends(get_db)
+    session: Session = Depends(get_db),
+    recommender: MovieRecommender = Depends(get_model)
     ):
-    print('seeds', seeds)
-    # recommend movies based on seeds
-    message = recommender.recommend_movies(session, seeds.seeds)
+    debug_sampled(logger, 'Recommend request', user_id=user_id, seeds=len(seeds.seeds))
+    # recommend movies based on seeds. identical seed sets (onboarding picks)
+    # are answered from the cache, concurrent ones computed once. under load,
+    # seeds needing long-tail work are dropped and the answer is marked
+    # degraded (and not cached)
+    key = canonical_key(
+        [(s.id, s.rating) for s in seeds.seeds],
+        f"{recommender.build_version}:{recommender.engine}",
+        RECOMMEND_K,
+    )
+    async def compute():
+        movies, degraded = await scheduler.recommend(recommender, session, seeds.seeds, RECOMMEND_K)
+        return {"movies": movies, "degraded": degraded}
+
+    result = await responses.get_or_compute(
+        key, compute, cacheable=lambda r: bool(r["movies"]) and not r["degraded"]
+    )
 
     # save seeds
-    success = bool(message)
+    success = bool(result["movies"])
+    return {"success": success, "detail": result["movies"], "degraded": result["degraded"]}
+
+@app.post("/recommend/batch")
+async def get_batch_recommendations(
+    batch: SeedsBatch, user_id: str = Depends(verify_jwt),
+    session: Session = Depends(get_db),
+    recommender: MovieRecommender = Depends(get_model)
+    ):
+    """
+    Recommendations for several seed sets in one call.
+    detail holds one recommendation list per seed set, in request order.
+    """
+    if len(batch.batch) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_SIZE} seed sets per batch"
+        )
+    message = await run_cpu(recommender.recommend_batch, session, [s.seeds for s in batch.batch])
+    success = any(message)
     return {"success": success, "detail": message}
 
+# Prometheus scrape endpoint: request/stage/db latency histograms, seed and
+# row counters, long-tail cache and serving model gauges
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    registry.export_metrics()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# model version, build/load time and memory of the serving model
+@app.get("/admin/model", dependencies=[Depends(verify_admin)])
+async def get_model_info():
+    return {**registry.info(), "response_cache": responses.stats(), "scheduler": scheduler.stats()}
+
+
+# build/load the model again (artifact if present, else CSVs) in the
+# background and swap it in once it passes its checks. requests keep being
+# served by the current model meanwhile.
+@app.post("/admin/reload", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(verify_admin)])
+async def reload_model():
+    # a running reload or incremental update holds the registry lock
+    if registry.busy:
+        detail = "Reload already running" if registry.reloading else "Similarity update running, retry shortly"
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
+    asyncio.create_task(_reload())
+    return {"status": "reloading", "current": registry.info()}
+
+
+async def _reload():
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, registry.reload)
+    except ReloadInProgress:
+        # an update or reload took the lock after the busy check
+        registry.last_error = "ReloadInProgress: reload requested while another reload or update was running"
+        logger.warning('Model reload skipped, another reload or update is running')
+    except Exception:
+        # the old model keeps serving; last_error shows up in /admin/model
+        logger.exception('Model reload failed')
+
+
 # Backend API endpoints needed:
 # GET /user/ratings - Get user's ratings
 # POST /user/ratings - Save/update a rating
@@ -214,7 +425,7 @@ async def get_dev_movies():
     Development-only endpoint that returns mock movie data for frontend development.
     This endpoint should never be used in production.
     """
-    print('API CALLED')
+    logger.debug('Serving mock movies')
     if APP_ENV == "prod":
         raise HTTPException(
             status_code=404,
@@ -225,7 +436,6 @@ async def get_dev_movies():
     try:
         with open("mock_data.json", "r") as f:
             mock_data = json.load(f)
-        print(mock_data)
         return mock_data
     except FileNotFoundError:
         raise HTTPException(
@@ -300,7 +510,8 @@ async def dev_login(session: Session = Depends(get_db)):
         )
     
     # Create or get test user
-    test_user = insert_user(
+    test_user = await run_db(
+        insert_user,
         session,
         google_id=None,  # No Google ID for dev login
         email="dev@example.com",
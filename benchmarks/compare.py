@@ -0,0 +1,51 @@
+# compares two benchmark result files stage by stage.
+# python -m benchmarks.compare old.json new.json
+# exits 1 when a stage got more than THRESHOLD times slower
+import json
+import sys
+
+
+THRESHOLD = 1.25
+# per-call stages are compared on the median, one-off stages on total time
+METRICS = ("p50_ms", "seconds")
+
+
+def metric(stage):
+    for name in METRICS:
+        if name in stage:
+            return name, stage[name]
+    return None, None
+
+
+def compare(old, new, threshold=THRESHOLD):
+    rows, regressions = [], []
+    for name, stage in new["stages"].items():
+        if name not in old["stages"]:
+            continue
+        key, after = metric(stage)
+        _, before = metric(old["stages"][name])
+        ratio = after / before if before else float("inf")
+        rows.append((name, key, before, after, ratio, stage["peak_rss_mb"] - old["stages"][name]["peak_rss_mb"]))
+        if ratio > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old["scale"] != new["scale"]:
+        print(f'Warning: comparing scale {old["scale"]} with {new["scale"]}')
+
+    print(f'{old["commit"]} -> {new["commit"]} ({new["scale"]})')
+    rows, regressions = compare(old, new)
+    for name, key, before, after, ratio, rss in rows:
+        flag = "  <-- slower" if name in regressions else ""
+        print(f'{name:40} {key:8} {before:12.4f} {after:12.4f} {ratio:6.2f}x  rss {rss:+.1f} MB{flag}')
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
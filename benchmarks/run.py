@@ -0,0 +1,201 @@
+# times the build and serving stages of MovieRecommender on synthetic data
+# and writes the results as JSON.
+# python -m benchmarks.run [scale] [out.json] [database_url]
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import scipy
+from benchmarks import synthetic
+from recommender import knn, loader
+from recommender.db import make_session_factory, insert_all_similarities
+from recommender.recommender import MovieRecommender
+from recommender.registry import model_bytes, resident_bytes
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# movies timed per call for topk_movies / high_support_similarities
+SAMPLE_MOVIES = 200
+# seed lists per size for find_recommended_movies
+SAMPLE_SEED_LISTS = 50
+SEED_SIZES = (1, 10, 100)
+K = 10
+# how often the peak memory sampler reads the resident set size
+RSS_INTERVAL = 0.005
+
+
+class PeakRSS:
+    """Samples the resident set size on a thread while the block runs."""
+
+    def __enter__(self):
+        self.start = self.peak = resident_bytes() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, resident_bytes() or 0)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, resident_bytes() or 0)
+
+
+def _mb(n):
+    return round(n / 2**20, 1)
+
+
+# runs fn once, records its time and peak rss
+def measure(results, name, fn):
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        out = fn()
+        seconds = time.perf_counter() - started
+    results[name] = {
+        "seconds": round(seconds, 4),
+        "peak_rss_mb": _mb(rss.peak),
+        "rss_growth_mb": _mb(rss.peak - rss.start),
+    }
+    print(f'{name}: {seconds:.3f}s, peak rss {_mb(rss.peak)} MB')
+    return out
+
+
+# runs fn(arg) for every arg and records per-call latency percentiles
+def measure_calls(results, name, fn, args):
+    latencies = []
+
+    def run():
+        for arg in args:
+            started = time.perf_counter()
+            fn(arg)
+            latencies.append(time.perf_counter() - started)
+
+    measure(results, name, run)
+    ms = np.asarray(latencies) * 1000
+    results[name].update({
+        "calls": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "max_ms": round(float(ms.max()), 4),
+    })
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(scale="100k", database_url=None, seed=0):
+    folder = synthetic.scale_folder(scale)
+    if not os.path.isfile(os.path.join(folder, "ratings.csv")):
+        print(f'Generating {scale} synthetic ratings in {folder}')
+        synthetic.generate(scale, folder, seed)
+
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    database_url = database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    rng = np.random.default_rng(seed)
+    stages = {}
+
+    recommender = MovieRecommender(folder=folder, build=False)
+    # a cold import: parse the csv, not the columnar cache of an earlier run
+    shutil.rmtree(os.path.join(folder, loader.CACHE_DIR), ignore_errors=True)
+    measure(stages, "import_ratings", recommender.import_ratings)
+    recommender.import_movies()
+    measure(stages, "create_X", lambda: recommender.create_X(recommender.ratings))
+    measure(stages, "calculate_similarities", recommender.calculate_similarities)
+    measure(stages, "build_indexes", recommender.build_indexes)
+
+    # least rated movies first: the long-tail path is what
+    # high_support_similarities is for
+    by_support = np.argsort(recommender.supports, kind="stable")
+    long_tail_ids = recommender.movie_inv_mapper[by_support[:SAMPLE_MOVIES]].tolist()
+    measure_calls(stages, "high_support_similarities", lambda m: recommender.high_support_similarities(m, K), long_tail_ids)
+
+    # topk_movies on a popularity-weighted sample, like real seeds
+    popularity = recommender.supports / recommender.supports.sum()
+    seed_cols = rng.choice(len(popularity), SAMPLE_MOVIES, p=popularity)
+    session = make_session_factory(database_url)()
+    try:
+        topk_ids = recommender.movie_inv_mapper[seed_cols].tolist()
+        measure_calls(stages, "topk_movies", lambda m: recommender.topk_movies(session, m, K), topk_ids)
+
+        for size in SEED_SIZES:
+            size = min(size, len(popularity))
+            seed_lists = [
+                [
+                    (int(recommender.movie_inv_mapper[c]), float(r))
+                    for c, r in zip(
+                        rng.choice(len(popularity), size, replace=False, p=popularity),
+                        rng.integers(1, 11, size) / 2,
+                    )
+                ]
+                for _ in range(SAMPLE_SEED_LISTS)
+            ]
+            measure_calls(
+                stages, f"find_recommended_movies_{size}_seeds",
+                lambda seeds: recommender.find_recommended_movies(session, seeds, max_results=50),
+                seed_lists,
+            )
+
+        measure(stages, "insert_all_similarities", lambda: insert_all_similarities(session, *recommender.similarities))
+    finally:
+        session.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    return {
+        "scale": scale,
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": time.time(),
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "engine": recommender.engine,
+            "knn_backend": knn.KNN_BACKEND,
+            "database": database_url.split(":", 1)[0],
+        },
+        "dataset": {
+            "ratings": int(recommender.X_csc.nnz),
+            "users": int(recommender.X_csc.shape[0]),
+            "movies": int(recommender.X_csc.shape[1]),
+        },
+        "model_mb": _mb(model_bytes(recommender)),
+        "stages": stages,
+    }
+
+
+def main(scale="100k", out=None, database_url=None):
+    results = run(scale, database_url)
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{scale}-{results['commit'] or 'nogit'}.json")
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f'Wrote {out}')
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,146 @@
+# MovieLens-shaped synthetic data: movies.csv + ratings.csv with power-law
+# item popularity and user activity, at the scales of the real datasets.
+# python -m benchmarks.synthetic 1m [folder]
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+
+# name -> (ratings, users, movies), roughly the MovieLens releases
+SCALES = {
+    "100k": (100_000, 610, 9_700),
+    "1m": (1_000_000, 6_040, 3_700),
+    "10m": (10_000_000, 70_000, 10_700),
+    "32m": (32_000_000, 200_000, 87_000),
+}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# popularity of the movie at rank r is proportional to r ** -ITEM_ZIPF
+ITEM_ZIPF = 1.0
+# pareto shape of ratings per user; every user has at least MIN_USER_RATINGS
+USER_PARETO = 1.2
+MIN_USER_RATINGS = 20
+# users generated and written per chunk
+USER_CHUNK = 5_000
+# largest share of the movies one user rates
+MAX_USER_SHARE = 0.25
+# users rating more than this share of the movies are sampled one by one
+HEAVY_USER_SHARE = 0.02
+# rounds used to spread capped activity and to top up users whose draws
+# hit the same movies
+MAX_ROUNDS = 8
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Children", "Comedy", "Crime",
+    "Documentary", "Drama", "Fantasy", "Film-Noir", "Horror", "IMAX",
+    "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western",
+]
+
+
+def scale_folder(scale):
+    return os.path.join(DATA_DIR, f"ml-synthetic-{scale}")
+
+
+def movies_frame(movie_ids, rng):
+    years = rng.integers(1920, 2024, len(movie_ids))
+    n_genres = rng.integers(1, 4, len(movie_ids))
+    genres = [
+        "|".join(sorted(rng.choice(GENRES, n, replace=False)))
+        for n in n_genres
+    ]
+    return pd.DataFrame({
+        "movieId": movie_ids,
+        "title": [f"Synthetic Movie {m} ({y})" for m, y in zip(movie_ids.tolist(), years.tolist())],
+        "genres": genres,
+    })
+
+
+# ratings per user: pareto distributed, scaled so they add up to about
+# n_ratings. nobody rates more than MAX_USER_SHARE of the movies; what the
+# capped users lose goes to the others
+def user_activity(n_ratings, n_users, n_movies, rng):
+    activity = rng.pareto(USER_PARETO, n_users) + 1.0
+    cap = max(MIN_USER_RATINGS, int(n_movies * MAX_USER_SHARE))
+    counts = np.full(n_users, MIN_USER_RATINGS, dtype=np.float64)
+    for _ in range(MAX_ROUNDS):
+        open_ = counts < cap
+        left = n_ratings - counts.sum()
+        if left < 1 or not open_.any():
+            break
+        counts[open_] += left * activity[open_] / activity[open_].sum()
+        counts = np.minimum(counts, cap)
+    return np.rint(counts).astype(np.int64)
+
+
+# distinct (user, movie) pairs, counts[u] per user.
+# light users draw with replacement by popularity; repeats of popular movies
+# are dropped and the user draws again. users rating a large share of the
+# catalog would take many rounds, they sample without replacement instead
+def user_items(counts, popularity, rng):
+    n_movies = len(popularity)
+    heavy = counts > n_movies * HEAVY_USER_SHARE
+    light = np.where(heavy, 0, counts)
+
+    keys = np.zeros(0, dtype=np.int64)
+    for _ in range(MAX_ROUNDS):
+        short = light - np.bincount(keys // n_movies, minlength=len(counts))
+        if not np.any(short > 0):
+            break
+        users = np.repeat(np.arange(len(counts)), 2 * np.maximum(short, 0))
+        keys = np.union1d(keys, users * n_movies + rng.choice(n_movies, len(users), p=popularity))
+
+    # keep a random light[u] of every light user's movies
+    keys = keys[rng.permutation(len(keys))]
+    users = keys // n_movies
+    order = np.argsort(users, kind="stable")
+    keys, users = keys[order], users[order]
+    starts = np.searchsorted(users, np.arange(len(counts)))
+    rank = np.arange(len(keys)) - starts[users]
+    keys = [keys[rank < light[users]]]
+
+    for u in np.flatnonzero(heavy):
+        keys.append(u * n_movies + rng.choice(n_movies, counts[u], replace=False, p=popularity))
+    keys = np.sort(np.concatenate(keys))
+    return keys // n_movies, keys % n_movies
+
+
+# writes movies.csv and ratings.csv to folder, returns what was written
+def generate(scale, folder=None, seed=0):
+    n_ratings, n_users, n_movies = SCALES[scale]
+    folder = folder or scale_folder(scale)
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    # sparse movie ids like MovieLens, so id lookups aren't just offsets
+    movie_ids = np.sort(rng.choice(np.arange(1, 3 * n_movies), n_movies, replace=False))
+    movies_frame(movie_ids, rng).to_csv(os.path.join(folder, "movies.csv"), index=False)
+
+    popularity = np.arange(1, n_movies + 1, dtype=np.float64) ** -ITEM_ZIPF
+    popularity = rng.permutation(popularity / popularity.sum())
+    quality = rng.normal(3.5, 0.5, n_movies)
+    counts = user_activity(n_ratings, n_users, n_movies, rng)
+
+    ratings_path = os.path.join(folder, "ratings.csv")
+    written = 0
+    for start in range(0, n_users, USER_CHUNK):
+        chunk = counts[start:start + USER_CHUNK]
+        users, items = user_items(chunk, popularity, rng)
+
+        bias = rng.normal(0.0, 0.4, len(chunk))
+        value = quality[items] + bias[users] + rng.normal(0.0, 0.9, len(users))
+        value = np.clip(np.rint(value * 2) / 2, 0.5, 5.0)
+        pd.DataFrame({
+            "userId": users + start + 1,
+            "movieId": movie_ids[items],
+            "rating": value,
+            "timestamp": rng.integers(946_684_800, 1_704_067_200, len(users)),
+        }).to_csv(ratings_path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+        written += len(users)
+
+    return {"folder": folder, "ratings": written, "users": n_users, "movies": n_movies, "seed": seed}
+
+
+if __name__ == "__main__":
+    print(generate(*sys.argv[1:]))
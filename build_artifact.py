@@ -0,0 +1,19 @@
+# builds the recommender offline and writes the serving artifact.
+# app.py maps this artifact at startup instead of retraining.
+from recommender.artifact import ARTIFACT_PATH
+from recommender.recommender import MovieRecommender
+from recommender.log import setup_logging
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def main():
+    recommender = MovieRecommender()
+    print(f'Writing artifact to {ARTIFACT_PATH}')
+    manifest = recommender.save_artifact(ARTIFACT_PATH)
+    print('Built artifact', manifest["build_version"])
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,54 @@
+# precomputes top-N recommendations for every user with ratings in the
+# database (including is_import users) and stores them in user_recommendations
+from collections import defaultdict
+from recommender.artifact import ARTIFACT_PATH, artifact_exists
+from recommender.db import get_db, replace_user_recommendations
+from recommender.models import Rating
+from recommender.recommender import MovieRecommender
+from recommender.log import setup_logging
+from dotenv import load_dotenv
+load_dotenv()
+
+
+BATCH_SIZE = 5000   # users scored and written per transaction
+TOP_N = 50          # recommendations stored per user
+
+
+def main():
+    session = next(get_db())
+    if artifact_exists(ARTIFACT_PATH):
+        recommender = MovieRecommender(artifact_path=ARTIFACT_PATH)
+    else:
+        recommender = MovieRecommender()
+
+    try:
+        user_ids = [u for (u,) in session.query(Rating.user_id).distinct().order_by(Rating.user_id)]
+        print(f'Scoring {len(user_ids)} users')
+
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            batch = user_ids[start:start + BATCH_SIZE]
+            rows = (
+                session.query(Rating.user_id, Rating.movie_id, Rating.value)
+                    .filter(Rating.user_id >= batch[0], Rating.user_id <= batch[-1])
+                    .all()
+            )
+            seeds = defaultdict(list)
+            for user_id, movie_id, value in rows:
+                seeds[user_id].append((movie_id, value))
+
+            recommendations = recommender.find_batch_recommended_movies(
+                session, [seeds[u] for u in batch], max_results=TOP_N
+            )
+            replace_user_recommendations(session, batch, recommendations, recommender.build_version)
+            print(f'Stored recommendations for {start + len(batch)}/{len(user_ids)} users')
+    except:
+        print('Exception')
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,71 @@
+# bulk loads a MovieLens ratings.csv into the ratings table.
+# every MovieLens user becomes an is_import user named "ml-<userId>";
+# re-running the import updates existing ratings instead of duplicating them.
+import sys
+from recommender import loader
+from recommender.db import get_db, upsert_ratings
+from recommender.models import User
+from recommender.log import setup_logging
+from dotenv import load_dotenv
+load_dotenv()
+
+
+BATCH_SIZE = 50_000   # ratings upserted per transaction
+
+
+# {movielens user id: users.id}, creating the import users that are missing
+def import_users(session, ml_user_ids):
+    names = {f"ml-{u}": int(u) for u in ml_user_ids}
+    existing = {
+        name: id_
+        for id_, name in session.query(User.id, User.name).filter(User.is_import.is_(True))
+        if name in names
+    }
+    missing = [name for name in names if name not in existing]
+    if missing:
+        session.bulk_insert_mappings(User, [{"name": name, "is_import": True} for name in missing])
+        session.commit()
+        existing = {
+            name: id_
+            for id_, name in session.query(User.id, User.name).filter(User.is_import.is_(True))
+            if name in names
+        }
+    return {names[name]: id_ for name, id_ in existing.items()}
+
+
+def main(folder="data/ml-latest-small"):
+    session = next(get_db())
+    try:
+        ratings = loader.load_ratings(f"recommender/{folder}", keep_timestamp=True)
+        print(f'Importing {len(ratings)} ratings from {folder}')
+
+        user_map = import_users(session, ratings["userId"].unique())
+        user_ids = ratings["userId"].map(user_map).to_numpy()
+        movie_ids = ratings["movieId"].to_numpy()
+        values = ratings["rating"].to_numpy()
+        timestamps = ratings["timestamp"].to_numpy()
+
+        for start in range(0, len(ratings), BATCH_SIZE):
+            stop = min(start + BATCH_SIZE, len(ratings))
+            rows = [
+                {"user_id": u, "movie_id": m, "value": v, "timestamp": t}
+                for u, m, v, t in zip(
+                    user_ids[start:stop].tolist(),
+                    movie_ids[start:stop].tolist(),
+                    values[start:stop].tolist(),
+                    timestamps[start:stop].tolist(),
+                )
+            ]
+            upsert_ratings(session, rows)
+            print(f'Imported {stop}/{len(ratings)} ratings')
+    except:
+        print('Exception')
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main(*sys.argv[1:])
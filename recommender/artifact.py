@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+from scipy.sparse import csc_matrix
+from recommender.catalog import Catalog
+
+
+# bump when the on-disk layout changes; older artifacts are refused on load
+ARTIFACT_FORMAT = 3
+MANIFEST = "manifest.json"
+
+# where setup.py / build_artifact.py write and app.py reads, unless overridden
+DEFAULT_ARTIFACT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "artifact")
+ARTIFACT_PATH = os.getenv("ARTIFACT_PATH", DEFAULT_ARTIFACT_PATH)
+
+ARRAYS = [
+    # utility matrix in CSC layout, shape = (n_users, n_items)
+    "X_indptr", "X_indices", "X_data",
+    # inverse mappers: row/column index -> userId/movieId
+    "user_ids", "movie_ids",
+    # number of users who rated each item column
+    "supports",
+    # movieIds kept as high support movies
+    "high_support_ids",
+    # top-K neighbor table, same triple setup.py stores in movie_similarities
+    "anchor_ids", "neighbor_ids", "weighted_sims",
+    # raw kNN lists of every item column, for incremental updates
+    "knn_indices", "knn_sims",
+    # users.id of live users, X rows after the MovieLens users
+    "live_user_ids",
+    # movie catalog (see catalog.Catalog), strings packed as utf-8 blobs + offsets
+    "catalog_ids",
+    "title_blob", "title_offsets",
+    "genre_blob", "genre_offsets",
+    "genre_mask", "genre_name_blob", "genre_name_offsets",
+]
+
+# only written when the model has them
+OPTIONAL_ARRAYS = [
+    # ALS item factors (see mf.ALSModel), one row per item column
+    "mf_item_factors",
+]
+
+
+# writes a versioned artifact directory for a fully built recommender.
+# files go to a temp dir first and are renamed into place, so a reader
+# never sees a half written artifact.
+def save_artifact(path, recommender, anchor_ids, neighbor_ids, weighted_sims):
+    X_csc = recommender.X_csc
+
+    arrays = {
+        "X_indptr": X_csc.indptr,
+        "X_indices": X_csc.indices,
+        "X_data": X_csc.data.astype(np.float32),
+        "user_ids": np.asarray(recommender.user_inv_mapper, dtype=np.int64),
+        "movie_ids": np.asarray(recommender.movie_inv_mapper, dtype=np.int64),
+        "supports": np.asarray(recommender.supports, dtype=np.int64),
+        "high_support_ids": np.array(sorted(recommender.high_support_movies), dtype=np.int64),
+        "anchor_ids": np.asarray(anchor_ids, dtype=np.int64),
+        "neighbor_ids": np.asarray(neighbor_ids, dtype=np.int64),
+        "weighted_sims": np.asarray(weighted_sims, dtype=np.float32),
+        "knn_indices": np.asarray(recommender.knn_indices, dtype=np.int32),
+        "knn_sims": np.asarray(recommender.knn_sims, dtype=np.float64),
+        "live_user_ids": np.asarray(recommender.live_user_ids, dtype=np.int64),
+        **recommender.catalog.arrays(),
+    }
+    if recommender.mf is not None:
+        arrays["mf_item_factors"] = np.asarray(recommender.mf.item_factors, dtype=np.float32)
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "build_version": f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}",
+        "built_at": time.time(),
+        "folder": recommender.folder,
+        "shape": list(X_csc.shape),
+        # live ratings up to this ratings.seq are already in the matrix
+        "ratings_seq": int(recommender.ratings_watermark),
+        "arrays": sorted(arrays),
+    }
+    if recommender.mf is not None:
+        manifest["mf"] = {"global_mean": recommender.mf.global_mean, "reg": recommender.mf.reg}
+
+    path = os.path.abspath(path)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(tmp_path)
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(arr))
+        with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        old_path = None
+        if os.path.exists(path):
+            old_path = f"{path}.old-{uuid.uuid4().hex[:8]}"
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return manifest
+
+
+def artifact_exists(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(
+            f"Artifact at {path} has format {manifest.get('format')}, expected {ARTIFACT_FORMAT}"
+        )
+    return manifest
+
+
+# loads every array of an artifact. with mmap=True the arrays are read-only
+# views over the page cache, so uvicorn workers on one machine share them.
+def load_artifact(path, mmap=True):
+    manifest = read_manifest(path)
+    mode = "r" if mmap else None
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+        for name in ARRAYS + [n for n in OPTIONAL_ARRAYS if n in manifest["arrays"]]
+    }
+    return manifest, arrays
+
+
+def artifact_matrix(manifest, arrays):
+    return csc_matrix(
+        (arrays["X_data"], arrays["X_indices"], arrays["X_indptr"]),
+        shape=tuple(manifest["shape"]),
+        copy=False,
+    )
+
+
+def artifact_catalog(arrays):
+    return Catalog.from_arrays(arrays)
@@ -0,0 +1,148 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from recommender import encoding
+from recommender.helpers import normalize
+
+
+Movie = namedtuple("Movie", ["id", "title", "genres"])
+
+
+def pack_strings(values):
+    encoded = [str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def unpack_strings(blob, offsets):
+    raw = bytes(blob)
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+class Catalog:
+    """
+    Movie metadata in flat arrays, one row per movie:
+    - ids: movieId per row
+    - titles / genre strings: utf-8 blobs + offsets, decoded only when asked for
+    - genre_mask: bit i set when the movie has genre_names[i]
+    - lookup: dense movieId -> row array (-1 for unknown ids)
+    - by_title: normalized title -> movieId, for exact title lookups
+    """
+
+    def __init__(self, ids, title_blob, title_offsets, genre_blob, genre_offsets, genre_mask, genre_names):
+        self.ids = ids
+        self.title_blob = title_blob
+        self.title_offsets = title_offsets
+        self.genre_blob = genre_blob
+        self.genre_offsets = genre_offsets
+        self.genre_mask = genre_mask
+        self.genre_names = list(genre_names)
+        self.lookup = encoding.lookup_array(ids)
+
+        # normalized titles are kept for the title search index as well
+        self.normalized = [normalize(t) for t in unpack_strings(title_blob, title_offsets)]
+        # same collision rule as the old dict: the last movie with a title wins
+        self.by_title = dict(zip(self.normalized, np.asarray(ids).tolist()))
+
+    # from the movies.csv frame (movieId, title, genres)
+    @classmethod
+    def from_frame(cls, df):
+        title_blob, title_offsets = pack_strings(df["title"])
+        genre_blob, genre_offsets = pack_strings(df["genres"])
+
+        # only a few hundred distinct genre strings: build the mask once per
+        # distinct string and broadcast it with the factorized codes
+        codes, combos = pd.factorize(df["genres"].astype(str))
+        split = [combo.split("|") for combo in combos]
+        genre_names = sorted({g for genres in split for g in genres})
+        if len(genre_names) > 64:
+            raise ValueError(f"{len(genre_names)} genres do not fit a 64 bit genre mask")
+        bit = {g: 1 << i for i, g in enumerate(genre_names)}
+        combo_mask = np.array([sum(bit[g] for g in set(genres)) for genres in split], dtype=np.uint64)
+
+        return cls(
+            df["movieId"].to_numpy(dtype=np.int64),
+            title_blob, title_offsets,
+            genre_blob, genre_offsets,
+            combo_mask[codes], genre_names,
+        )
+
+    # from the catalog arrays of a loaded artifact
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays["catalog_ids"],
+            arrays["title_blob"], arrays["title_offsets"],
+            arrays["genre_blob"], arrays["genre_offsets"],
+            arrays["genre_mask"],
+            unpack_strings(arrays["genre_name_blob"], arrays["genre_name_offsets"]),
+        )
+
+    # the arrays from_arrays expects, for save_artifact
+    def arrays(self):
+        genre_name_blob, genre_name_offsets = pack_strings(self.genre_names)
+        return {
+            "catalog_ids": np.asarray(self.ids, dtype=np.int64),
+            "title_blob": self.title_blob,
+            "title_offsets": self.title_offsets,
+            "genre_blob": self.genre_blob,
+            "genre_offsets": self.genre_offsets,
+            "genre_mask": np.asarray(self.genre_mask, dtype=np.uint64),
+            "genre_name_blob": genre_name_blob,
+            "genre_name_offsets": genre_name_offsets,
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, movie_id):
+        return self.row(movie_id) >= 0
+
+    # row of movie_id, -1 if it is not in the catalog
+    def row(self, movie_id):
+        try:
+            return encoding.index_of(self.lookup, movie_id)
+        except (TypeError, ValueError):
+            return -1
+
+    def _string(self, blob, offsets, row):
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def title(self, movie_id):
+        r = self.row(movie_id)
+        return self._string(self.title_blob, self.title_offsets, r) if r >= 0 else None
+
+    def genres(self, movie_id):
+        r = self.row(movie_id)
+        return self._string(self.genre_blob, self.genre_offsets, r) if r >= 0 else None
+
+    def get(self, movie_id):
+        r = self.row(movie_id)
+        if r < 0:
+            return None
+        return Movie(
+            int(self.ids[r]),
+            self._string(self.title_blob, self.title_offsets, r),
+            self._string(self.genre_blob, self.genre_offsets, r),
+        )
+
+    # [{"id", "title", "genres"}, ...] for the known ids, in order
+    def movies(self, movie_ids):
+        return [
+            {"id": m.id, "title": m.title, "genres": m.genres}
+            for m in (self.get(mid) for mid in movie_ids)
+            if m is not None
+        ]
+
+    # movieId for a title in any casing/punctuation, None if unknown
+    def find_title(self, title):
+        return self.by_title.get(normalize(title))
+
+    # boolean mask over rows: movies tagged with genre
+    def has_genre(self, genre):
+        if genre not in self.genre_names:
+            return np.zeros(len(self.ids), dtype=bool)
+        bit = np.uint64(1) << np.uint64(self.genre_names.index(genre))
+        return (self.genre_mask & bit) != 0
@@ -1,20 +1,50 @@
+import io
+import logging
 import os
+import time
 from dotenv import load_dotenv
 import csv
+import numpy as np
 
-from sqlalchemy import create_engine, String, text, and_
+from sqlalchemy import create_engine, String, MetaData, inspect, text, and_, or_, insert, select, func
 from sqlalchemy.orm import sessionmaker
-from recommender.models import Base, MovieSimilarity, User, Rating
+from recommender.models import Base, MovieSimilarity, User, Rating, UserRecommendation, RATING_SEQ
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import OperationalError
+from recommender.metrics import DB_SECONDS, DB_ROWS, timed
+from recommender.log import debug_sampled
 load_dotenv()
 POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 
+logger = logging.getLogger(__name__)
+
+
+# connection pool settings. pre-ping replaces connections the database
+# dropped (e.g. after a Postgres restart) instead of failing the request.
+# the pool should cover the DB_THREADS + CPU_THREADS in recommender/workers.py
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+
+
+def make_engine(db_url: str):
+    options = {"echo": SQL_ECHO, "pool_pre_ping": True}
+    if not db_url.startswith("sqlite"):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return create_engine(db_url, **options)
+
 
 # factory that gives a SessionLocal for any URL
 def make_session_factory(db_url: str):
-    engine = create_engine(db_url, echo=True)
+    engine = make_engine(db_url)
     Base.metadata.create_all(bind=engine)
     return sessionmaker(bind=engine)
 
@@ -38,34 +68,229 @@ def get_db():
         db.close()
 
 
-def insert_all_similarities(session, anchor_ids, neighbor_ids, weighted_sims):
-    batch = []
+# rows per COPY buffer / executemany batch when loading similarities
+SIMILARITY_CHUNK = 100_000
 
-    session.query(MovieSimilarity).delete()
-    session.commit()
-    # anchor_ids, neighbor_ids, raw_sims, co_counts, weighted_sims
-    for (a_id, n_id, w_sim) in zip(
-        anchor_ids, neighbor_ids, weighted_sims
-    ):
-        batch.append(
-            MovieSimilarity(
-                movie_id=a_id,
-                neighbor_id=n_id,
-                weighted_sim=w_sim,
+
+# copy of the movie_similarities table under another name. its indexes are
+# returned separately (renamed with the same suffix) so they can be built
+# after the bulk load instead of being maintained row by row.
+def _staging_table(name, suffix):
+    table = MovieSimilarity.__table__.to_metadata(MetaData(), name=name)
+    indexes = list(table.indexes)
+    table.indexes.clear()
+    for index in indexes:
+        index.name = f"{index.name}{suffix}"
+    return table, indexes
+
+
+def _copy_similarities(conn, table, anchor_ids, neighbor_ids, weighted_sims):
+    columns = "movie_id, neighbor_id, weighted_sim"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        for start in range(0, len(anchor_ids), SIMILARITY_CHUNK):
+            stop = start + SIMILARITY_CHUNK
+            buf = io.StringIO()
+            np.savetxt(
+                buf,
+                np.column_stack([anchor_ids[start:stop], neighbor_ids[start:stop], weighted_sims[start:stop]]),
+                fmt=["%d", "%d", "%.8g"],
+                delimiter="\t",
             )
+            buf.seek(0)
+            cursor.copy_expert(f"COPY {table.name} ({columns}) FROM STDIN", buf)
+    finally:
+        cursor.close()
+
+
+def _executemany_similarities(conn, table, anchor_ids, neighbor_ids, weighted_sims):
+    for start in range(0, len(anchor_ids), SIMILARITY_CHUNK):
+        stop = start + SIMILARITY_CHUNK
+        conn.execute(table.insert(), [
+            {"movie_id": a_id, "neighbor_id": n_id, "weighted_sim": w_sim}
+            for a_id, n_id, w_sim in zip(
+                anchor_ids[start:stop].tolist(),
+                neighbor_ids[start:stop].tolist(),
+                weighted_sims[start:stop].tolist(),
+            )
+        ])
+
+
+# replaces every row of movie_similarities without readers ever seeing an
+# empty or partial table. rows are streamed into a staging table (COPY on
+# PostgreSQL, executemany elsewhere), indexed, and then swapped in with
+# renames inside a single transaction.
+def insert_all_similarities(session, anchor_ids, neighbor_ids, weighted_sims):
+    # each (anchor, neighbor) pair is written in both directions
+    anchor_ids, neighbor_ids = (
+        np.concatenate([np.asarray(anchor_ids, dtype=np.int64), np.asarray(neighbor_ids, dtype=np.int64)]),
+        np.concatenate([np.asarray(neighbor_ids, dtype=np.int64), np.asarray(anchor_ids, dtype=np.int64)]),
+    )
+    weighted_sims = np.tile(np.asarray(weighted_sims, dtype=np.float32), 2)
+
+    live = MovieSimilarity.__tablename__
+    staging_name, old_name = f"{live}_staging", f"{live}_old"
+    staging, staging_indexes = _staging_table(staging_name, "_staging")
+    live_indexes = list(MovieSimilarity.__table__.indexes)
+
+    conn = session.connection()
+    postgres = conn.dialect.name == "postgresql"
+    try:
+        # 1) load and index the staging table
+        staging.drop(conn, checkfirst=True)
+        staging.create(conn)
+        if postgres:
+            _copy_similarities(conn, staging, anchor_ids, neighbor_ids, weighted_sims)
+        else:
+            _executemany_similarities(conn, staging, anchor_ids, neighbor_ids, weighted_sims)
+        for index in staging_indexes:
+            index.create(conn)
+        session.commit()
+
+        # 2) swap it in
+        conn = session.connection()
+        has_live = inspect(conn).has_table(live)
+        if not postgres and not conn.connection.dbapi_connection.in_transaction:
+            # pysqlite doesn't open a transaction for DDL on its own
+            conn.exec_driver_sql("BEGIN")
+        conn.execute(text(f"DROP TABLE IF EXISTS {old_name}"))
+        if has_live:
+            conn.execute(text(f"ALTER TABLE {live} RENAME TO {old_name}"))
+        conn.execute(text(f"ALTER TABLE {staging_name} RENAME TO {live}"))
+        if has_live:
+            conn.execute(text(f"DROP TABLE {old_name}"))
+        if postgres:
+            # renames are metadata only, the indexes were built in step 1
+            conn.execute(text(f"ALTER TABLE {live} RENAME CONSTRAINT {staging_name}_pkey TO {live}_pkey"))
+            for index in staging_indexes:
+                conn.execute(text(f"ALTER INDEX {index.name} RENAME TO {index.name[:-len('_staging')]}"))
+        else:
+            # sqlite can't rename indexes; rebuild them under their real names
+            for index in staging_indexes:
+                conn.execute(text(f"DROP INDEX {index.name}"))
+            for index in live_indexes:
+                index.create(conn)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+# stored top-k neighbors of one movie, best first. a single range scan of
+# ix_movie_similarities_movie_id_weighted_sim with the LIMIT in SQL.
+# build_version picks the long-tail rows written back for that model
+# version; None (the default) the rows of the kNN build
+def get_similarities(session, movie_id, k, build_version=None):
+    version = MovieSimilarity.build_version
+    same_build = version.is_(None) if build_version is None else version == build_version
+    with DB_SECONDS.time(query="get_similarities"):
+        rows = (
+            session.query(MovieSimilarity)
+                .filter(MovieSimilarity.movie_id == movie_id, same_build)
+                .order_by(MovieSimilarity.weighted_sim.desc())
+                .limit(k)
+                .all()
         )
+    DB_ROWS.inc(len(rows), query="get_similarities")
+    return rows
 
-    # Bulk‐save
-    session.bulk_save_objects(batch)
-    session.commit()
+
+# write the computed long-tail neighbors of an obscure movie back, in both
+# directions like every other pair, tagged with the model version. rows of
+# the kNN build are never overwritten
+@timed(DB_SECONDS, query="insert_long_tail_similarities")
+def insert_long_tail_similarities(session, movie_id, neighbor_ids, weighted_sims, build_version):
+    rows = []
+    for n_id, w_sim in zip(neighbor_ids, weighted_sims):
+        rows.append({"movie_id": int(movie_id), "neighbor_id": int(n_id), "weighted_sim": float(w_sim), "build_version": build_version})
+        rows.append({"movie_id": int(n_id), "neighbor_id": int(movie_id), "weighted_sim": float(w_sim), "build_version": build_version})
+    stmt = _upsert(
+        session, MovieSimilarity, [MovieSimilarity.movie_id, MovieSimilarity.neighbor_id],
+        ["weighted_sim", "build_version"], where=MovieSimilarity.build_version.isnot(None),
+    )
+    try:
+        session.execute(stmt, rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+# incremental update of movie_similarities. every pair is stored under its
+# smaller movie id (its anchor) in both directions; all pairs anchored at
+# changed_ids are deleted and the new pairs written, in one transaction.
+# anchor_ids / neighbor_ids / weighted_sims hold each new pair once.
+# written-back long-tail rows belong to the model being replaced and go too
+def replace_anchored_similarities(session, changed_ids, anchor_ids, neighbor_ids, weighted_sims):
+    changed_ids = [int(i) for i in changed_ids]
+    anchor_ids = np.asarray(anchor_ids, dtype=np.int64)
+    neighbor_ids = np.asarray(neighbor_ids, dtype=np.int64)
+    weighted_sims = np.asarray(weighted_sims, dtype=np.float32)
+    # rows may already be there if another worker applied the same update
+    stmt = _upsert(
+        session, MovieSimilarity, [MovieSimilarity.movie_id, MovieSimilarity.neighbor_id],
+        ["weighted_sim", "build_version"],
+    )
+    try:
+        session.query(MovieSimilarity).filter(
+            MovieSimilarity.build_version.isnot(None)
+        ).delete(synchronize_session=False)
+        for start in range(0, len(changed_ids), 500):
+            chunk = changed_ids[start:start + 500]
+            session.query(MovieSimilarity).filter(or_(
+                and_(MovieSimilarity.movie_id.in_(chunk), MovieSimilarity.neighbor_id > MovieSimilarity.movie_id),
+                and_(MovieSimilarity.neighbor_id.in_(chunk), MovieSimilarity.movie_id > MovieSimilarity.neighbor_id),
+            )).delete(synchronize_session=False)
+
+        src = np.concatenate([anchor_ids, neighbor_ids]).tolist()
+        dst = np.concatenate([neighbor_ids, anchor_ids]).tolist()
+        sims = np.tile(weighted_sims, 2).tolist()
+        for start in range(0, len(src), SIMILARITY_CHUNK):
+            stop = start + SIMILARITY_CHUNK
+            session.execute(stmt, [
+                {"movie_id": a_id, "neighbor_id": n_id, "weighted_sim": w_sim, "build_version": None}
+                for a_id, n_id, w_sim in zip(src[start:stop], dst[start:stop], sims[start:stop])
+            ])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
 
 
+# replace the stored recommendations of a batch of users in one transaction.
+# recommendations = [(movie_ids, scores), ...] aligned with user_ids
+def replace_user_recommendations(session, user_ids, recommendations, build_version=None):
+    rows = [
+        {
+            "user_id": int(user_id),
+            "rank": rank,
+            "movie_id": int(movie_id),
+            "score": float(score),
+            "build_version": build_version,
+        }
+        for user_id, (movie_ids, scores) in zip(user_ids, recommendations)
+        for rank, (movie_id, score) in enumerate(zip(movie_ids, scores))
+    ]
+    try:
+        session.query(UserRecommendation).filter(
+            UserRecommendation.user_id.in_([int(u) for u in user_ids])
+        ).delete(synchronize_session=False)
+        if rows:
+            session.execute(insert(UserRecommendation), rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+@timed(DB_SECONDS, query="insert_user")
 def insert_user(session, google_id, email, name):
     try:
         user = session.query(User).filter_by(google_id=google_id).first()
     except OperationalError:
         session.rollback()
-        raise print(status_code=500, detail="Database connection lost.")
+        logger.error('Database connection lost while looking up user')
+        raise
     except Exception:
         session.rollback()
         raise
@@ -79,24 +304,90 @@ def insert_user(session, google_id, email, name):
     return user
 
 
-# change this to not be a named relation. just an int and a movie_id int
+# rows per INSERT ... ON CONFLICT statement in bulk rating writes
+RATING_CHUNK = 10_000
+
+
+# INSERT ... ON CONFLICT (keys) DO UPDATE SET updates for the session's dialect
+def _upsert(session, model, keys, updates, values=None, where=None):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"Upsert not supported on {dialect}")
+    stmt = dialect_insert(model)
+    if values:
+        # SQL expressions evaluated per row, e.g. the next sequence value
+        stmt = stmt.values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: stmt.excluded[name] for name in updates},
+        # only rows matching where are updated, the others kept as they are
+        where=where,
+    )
+
+
+# next ratings.seq. sqlite has no sequences, but it runs one write at a
+# time, so max + 1 can't be taken twice
+def _next_rating_seq(session):
+    if session.get_bind().dialect.name == "postgresql":
+        return RATING_SEQ.next_value()
+    return select(func.coalesce(func.max(Rating.seq), 0) + 1).scalar_subquery()
+
+
+# backed by the unique ix_ratings_user_id_movie_id index. inserts and
+# updates both take a new seq, so the incremental updater sees either
+def _rating_upsert(session):
+    return _upsert(
+        session, Rating, [Rating.user_id, Rating.movie_id], ["value", "timestamp", "seq"],
+        values={"seq": _next_rating_seq(session)},
+    )
+
+
+# insert or update one rating in a single statement; raises on failure
+@timed(DB_SECONDS, query="insert_rating")
 def insert_rating_in_db(session, user_id, movie_id, value):
-    print('inserting rating into db, balls')
+    debug_sampled(logger, 'Upserting rating', user_id=user_id, movie_id=movie_id)
     try:
-        rating = session.query(Rating).filter_by(user_id=user_id, movie_id=movie_id).first()
-        if not rating:
-            rating = Rating(user_id=user_id, movie_id=movie_id, value=value)
-            session.add(rating)
-            session.commit()
-            session.refresh(rating)
-            print('success!! balls2')
-            return True
-        return False
+        session.execute(_rating_upsert(session), {
+            "user_id": int(user_id),
+            "movie_id": int(movie_id),
+            "value": float(value),
+            "timestamp": int(time.time()),
+        })
+        session.commit()
     except Exception:
-        print('exception')
+        logger.exception('Rating upsert failed', extra={"user_id": user_id, "movie_id": movie_id})
         session.rollback()
         raise
 
+
+# upsert many ratings. rows = [{"user_id", "movie_id", "value"[, "timestamp"]}, ...]
+# each chunk is one executemany of the upsert statement. commits once at the end.
+@timed(DB_SECONDS, query="upsert_ratings")
+def upsert_ratings(session, rows, chunk_size=RATING_CHUNK):
+    now = int(time.time())
+    stmt = _rating_upsert(session)
+    try:
+        for start in range(0, len(rows), chunk_size):
+            session.execute(stmt, [
+                {
+                    "user_id": int(r["user_id"]),
+                    "movie_id": int(r["movie_id"]),
+                    "value": float(r["value"]),
+                    "timestamp": int(r.get("timestamp") or now),
+                }
+                for r in rows[start:start + chunk_size]
+            ])
+        session.commit()
+        return len(rows)
+    except Exception:
+        session.rollback()
+        raise
+
+
 # DEPRECATED: switching from Movies in database
 # def load_movies_from_csv(session, csv_path):
 #     movies_data = []
@@ -138,5 +429,5 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg2://", 1)
 
-engine = create_engine(DATABASE_URL, echo=True)
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
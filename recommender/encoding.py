@@ -0,0 +1,34 @@
+import numpy as np
+
+
+# compact 0..n-1 codes for raw ids.
+# returns (codes, uniques) where uniques[codes] == ids and uniques is sorted
+def encode_ids(ids):
+    uniques, codes = np.unique(np.asarray(ids), return_inverse=True)
+    return codes.astype(np.int32), uniques
+
+
+# dense id -> index array: lookup[uniques[i]] == i, -1 for unknown ids
+def lookup_array(uniques):
+    uniques = np.asarray(uniques, dtype=np.int64)
+    size = int(uniques.max()) + 1 if len(uniques) else 0
+    lookup = np.full(size, -1, dtype=np.int32)
+    lookup[uniques] = np.arange(len(uniques), dtype=np.int32)
+    return lookup
+
+
+# index of one id, -1 if it is not in the mapping
+def index_of(lookup, id_):
+    id_ = int(id_)
+    if 0 <= id_ < len(lookup):
+        return int(lookup[id_])
+    return -1
+
+
+# vectorized index_of for an array of ids
+def indices_of(lookup, ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    out = np.full(ids.shape, -1, dtype=np.int32)
+    valid = (ids >= 0) & (ids < len(lookup))
+    out[valid] = lookup[ids[valid]]
+    return out
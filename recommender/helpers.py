@@ -1,18 +1,23 @@
 import unicodedata, re
 
+# compiled once, normalize runs for every title at startup and every lookup
+DATE_RE = re.compile(r"\(+[0-9]{4}\)+") # (date)
+NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+
 def normalize(s):
     # lowercase  
     s = s.lower()    
 
     # remove date if there
-    expression = r"\(+[0-9]{4}\)+" # (date)
-    if re.search(expression, s):
+    if DATE_RE.search(s):
         s = s[:-6]
 
-    # strip accents  
-    s = unicodedata.normalize('NFD', s)
-    s = ''.join(ch for ch in s if unicodedata.category(ch) != 'Mn')
+    # strip accents (ascii strings have none, skip the unicode pass)
+    if not s.isascii():
+        s = unicodedata.normalize('NFD', s)
+        s = ''.join(ch for ch in s if unicodedata.category(ch) != 'Mn')
     
     # remove non-alphanumeric & collapse whitespace  
-    s = re.sub(r'[^a-z0-9]+', ' ', s).strip()
-    return s
\ No newline at end of file
+    s = NON_ALNUM_RE.sub(' ', s).strip()
+    return s
@@ -0,0 +1,283 @@
+import os
+import time
+import uuid
+import numpy as np
+from scipy.sparse import csc_matrix
+from recommender import encoding, knn, similarity
+from recommender.db import get_db, replace_anchored_similarities
+from recommender.models import Rating, User
+from recommender.neighbors import NeighborIndex
+
+
+# seconds between background updates in app.py, 0 = off
+SIMILARITY_UPDATE_INTERVAL = float(os.getenv("SIMILARITY_UPDATE_INTERVAL", "0"))
+
+
+# cosine similarity of every item column in cols against all items,
+# (len(cols), n_items) dense, from the squared column norms
+def _cosine_rows(X_csc, norms2, cols):
+    dots = (X_csc[:, cols].T @ X_csc).toarray()
+    norms = np.sqrt(norms2)
+    denom = norms[cols][:, None] * norms[None, :]
+    denom[denom == 0] = np.inf
+    return dots / denom
+
+
+# the same top-k selection the kNN backends do: distance = 1 - cos clipped
+# to [0, 2], closest k + 1 sorted, rank 0 (the item itself) dropped
+def _top_k(cos, k):
+    dist = np.clip(1.0 - cos, 0.0, 2.0)
+    sample_range = np.arange(dist.shape[0])[:, None]
+    neigh_ind = np.argpartition(dist, k, axis=1)[:, :k + 1]
+    neigh_ind = neigh_ind[sample_range, np.argsort(dist[sample_range, neigh_ind], axis=1)]
+    return neigh_ind[:, 1:], 1.0 - dist[sample_range, neigh_ind[:, 1:]]
+
+
+class SimilarityUpdater:
+    """
+    Applies live ratings to a built MovieRecommender without a rebuild.
+
+    Ratings of non-import users written since the recommender's watermark
+    are applied to the utility matrix as a sparse delta. Per-item squared
+    norms and support counts are updated from the changed entries only, and
+    neighbor lists are recomputed for the touched items plus the items whose
+    lists a touched item enters or is part of. Only pairs anchored at those
+    items are rebuilt (with fresh co-counts) and written back.
+
+    The recommender it was given is never changed: every update builds a
+    copy, and `recommender` moves to that copy once it is complete. Serving
+    code publishes it with a single reference swap (ModelRegistry.publish).
+    """
+
+    def __init__(self, recommender, max_memory_mb=knn.KNN_MAX_MEMORY_MB):
+        if recommender.knn_indices is None:
+            raise ValueError("recommender has no kNN state, rebuild the artifact")
+        self.recommender = recommender
+        self.max_memory = max_memory_mb * 1024 * 1024
+        X = recommender.X_csc
+        self.norms2 = np.asarray(X.multiply(X).sum(axis=0), dtype=np.float64).ravel()
+
+    # live ratings (user_id, movie_id, value, seq) written after the
+    # watermark, the highest ratings.seq applied. seq comes from the database,
+    # so backdated or clock-skewed client timestamps can't hide a rating
+    def pull(self, session):
+        return (
+            session.query(Rating.user_id, Rating.movie_id, Rating.value, Rating.seq)
+                .join(User, User.id == Rating.user_id)
+                .filter(User.is_import.is_(False), Rating.seq > self.recommender.ratings_watermark)
+                .order_by(Rating.seq)
+                .all()
+        )
+
+    def _block_size(self, n_items):
+        # dots, norms and distances for a block are live at once
+        return max(1, int(self.max_memory // (n_items * 8 * 4)))
+
+    # grow the copy's matrix for unseen users / movies, return (rows, cols, values)
+    def _locate(self, r, rating_rows):
+        user_ids = np.array([row[0] for row in rating_rows], dtype=np.int64)
+        movie_ids = np.array([row[1] for row in rating_rows], dtype=np.int64)
+        values = np.array([row[2] for row in rating_rows], dtype=np.float64)
+
+        # movies outside the catalog are ignored
+        in_catalog = encoding.indices_of(r.catalog.lookup, movie_ids) >= 0
+        user_ids, movie_ids, values = user_ids[in_catalog], movie_ids[in_catalog], values[in_catalog]
+
+        new_movies = np.unique(movie_ids[encoding.indices_of(r.movie_mapper, movie_ids) < 0])
+        if len(new_movies):
+            r.movie_inv_mapper = np.concatenate([np.asarray(r.movie_inv_mapper), new_movies])
+            r.movie_mapper = encoding.lookup_array(r.movie_inv_mapper)
+        cols = encoding.indices_of(r.movie_mapper, movie_ids).astype(np.int64)
+
+        n_ml_users = len(r.user_inv_mapper)
+        live_rows = {int(u): n_ml_users + i for i, u in enumerate(np.asarray(r.live_user_ids).tolist())}
+        new_users = [u for u in dict.fromkeys(user_ids.tolist()) if u not in live_rows]
+        for u in new_users:
+            live_rows[u] = n_ml_users + len(live_rows)
+        if new_users:
+            r.live_user_ids = np.concatenate([np.asarray(r.live_user_ids), np.array(new_users, dtype=np.int64)])
+        rows = np.array([live_rows[u] for u in user_ids.tolist()], dtype=np.int64)
+
+        # later ratings of the same (user, movie) win
+        _, last = np.unique((rows * len(r.movie_inv_mapper) + cols)[::-1], return_index=True)
+        keep = len(rows) - 1 - last
+        return rows[keep], cols[keep], values[keep], len(new_movies)
+
+    # new neighbor lists for cols. with kth (every item's current k-th
+    # similarity) also (j, t, sim) for every item j that a col t now beats
+    def _recompute(self, X, norms2, cols, k, kth=None):
+        n_items = X.shape[1]
+        knn_indices = np.empty((len(cols), k), dtype=np.int32)
+        knn_sims = np.empty((len(cols), k), dtype=np.float64)
+        entries = []
+        step = self._block_size(n_items)
+        for start in range(0, len(cols), step):
+            block = cols[start:start + step]
+            cos = _cosine_rows(X, norms2, block)
+            ind, sims = _top_k(cos, k)
+            knn_indices[start:start + step] = ind
+            knn_sims[start:start + step] = sims
+            if kth is not None:
+                sims_all = 1.0 - np.clip(1.0 - cos, 0.0, 2.0)
+                hit_t, hit_j = np.nonzero(sims_all > kth[None, :])
+                hit_t_cols = block[hit_t]
+                ok = hit_t_cols != hit_j
+                entries.append((hit_j[ok], hit_t_cols[ok], sims_all[hit_t[ok], hit_j[ok]]))
+        return knn_indices, knn_sims, entries
+
+    # apply pulled ratings to a copy of the recommender, which becomes
+    # self.recommender when everything succeeded. returns a summary dict;
+    # `write` stores the changed pairs in movie_similarities through session
+    def apply(self, session, rating_rows, write=True):
+        k = similarity.K_NEIGHBORS
+        if not rating_rows:
+            return {"ratings": 0, "touched": 0, "anchors": 0, "pairs": 0}
+        watermark = max(int(row[3] or 0) for row in rating_rows)
+
+        r = self.recommender.copy()
+        rows, cols, values, n_new_movies = self._locate(r, rating_rows)
+
+        # 1) sparse delta on the (possibly grown) matrix
+        X = r.X_csc
+        n_users = len(r.user_inv_mapper) + len(r.live_user_ids)
+        n_items = len(r.movie_inv_mapper)
+        indptr = np.concatenate([X.indptr, np.full(n_items - X.shape[1], X.indptr[-1], dtype=X.indptr.dtype)])
+        X = csc_matrix((X.data, X.indices, indptr), shape=(n_users, n_items))
+        old = np.asarray(X[rows, cols], dtype=np.float64).ravel()
+        changed = old != values
+        rows, cols, values, old = rows[changed], cols[changed], values[changed], old[changed]
+        if not len(rows):
+            # everything pulled was already applied, only the watermark moves.
+            # same matrix and version: no new model unless it did move, so
+            # the serving model keeps its long-tail cache
+            if watermark != self.recommender.ratings_watermark:
+                r = self.recommender.copy()
+                r.ratings_watermark = watermark
+                r.long_tail_cache = self.recommender.long_tail_cache
+                self.recommender = r
+            return {"ratings": 0, "touched": 0, "anchors": 0, "pairs": 0, "watermark": watermark}
+        delta = csc_matrix((values - old, (rows, cols)), shape=X.shape)
+        X = (X + delta.astype(X.dtype)).tocsc()
+        X.sort_indices()
+
+        grow = n_items - len(self.norms2)
+        norms2 = np.concatenate([self.norms2, np.zeros(grow)])
+        np.add.at(norms2, cols, values ** 2 - old ** 2)
+        supports = np.concatenate([np.asarray(r.supports, dtype=np.int64), np.zeros(grow, dtype=np.int64)])
+        np.add.at(supports, cols, (old == 0).astype(np.int64))
+
+        knn_indices = np.vstack([np.asarray(r.knn_indices, dtype=np.int32), np.zeros((grow, k), dtype=np.int32)])
+        knn_sims = np.vstack([np.asarray(r.knn_sims, dtype=np.float64), np.full((grow, k), -np.inf)])
+
+        old_mask = np.zeros(n_items, dtype=bool)
+        old_mask[encoding.indices_of(r.movie_mapper, np.fromiter(r.high_support_movies, dtype=np.int64))] = True
+        top_items = similarity.top_support_items(supports, similarity.HIGH_SUPPORT_TOP_N)
+        mask = np.zeros(n_items, dtype=bool)
+        mask[top_items] = True
+        flipped = np.flatnonzero(mask != old_mask)
+
+        # 2) neighbor lists of touched items, and who they now enter
+        touched = np.unique(cols)
+        is_touched = np.zeros(n_items, dtype=bool)
+        is_touched[touched] = True
+        t_ind, t_sims, entries = self._recompute(X, norms2, touched, k, kth=knn_sims[:, -1])
+
+        # items that had a touched item in their list: their similarity to
+        # it changed (maybe down), so their whole list is recomputed
+        contains = np.isin(knn_indices, touched).any(axis=1) & ~is_touched
+        knn_indices[touched], knn_sims[touched] = t_ind, t_sims
+        redo = np.flatnonzero(contains)
+        if len(redo):
+            knn_indices[redo], knn_sims[redo], _ = self._recompute(X, norms2, redo, k)
+
+        # items a touched item now enters: merge it into the existing list
+        js = np.concatenate([e[0] for e in entries]) if entries else np.zeros(0, dtype=np.int64)
+        ts = np.concatenate([e[1] for e in entries]) if entries else np.zeros(0, dtype=np.int64)
+        ss = np.concatenate([e[2] for e in entries]) if entries else np.zeros(0)
+        keep = ~is_touched[js] & ~contains[js]
+        js, ts, ss = js[keep], ts[keep], ss[keep]
+        merged = np.unique(js)
+        if len(merged):
+            src = np.concatenate([np.repeat(merged, k), js])
+            dst = np.concatenate([knn_indices[merged].ravel(), ts])
+            sim = np.concatenate([knn_sims[merged].ravel(), ss])
+            order = np.lexsort((-sim, src))
+            src, dst, sim = src[order], dst[order], sim[order]
+            starts = np.searchsorted(src, merged)
+            take = (starts[:, None] + np.arange(k)[None, :]).ravel()
+            knn_indices[merged] = dst[take].reshape(-1, k)
+            knn_sims[merged] = sim[take].reshape(-1, k)
+
+        # 3) rebuild the pairs anchored at every item whose pairs can differ
+        anchors = np.zeros(n_items, dtype=bool)
+        anchors[touched] = True
+        anchors[redo] = True
+        anchors[merged] = True
+        anchors[flipped] = True
+        if len(flipped):
+            anchors |= np.isin(knn_indices, flipped).any(axis=1)
+        anchor_cols = np.flatnonzero(anchors)
+
+        ids = np.asarray(r.movie_inv_mapper)
+        a_rows = np.repeat(anchor_cols, k)
+        a_cols = knn_indices[anchor_cols].ravel().astype(np.int64)
+        raw = knn_sims[anchor_cols].ravel()
+        # same rule as similarity.knn_pairs
+        ok = mask[a_rows] & mask[a_cols] & (ids[a_rows] < ids[a_cols])
+        a_rows, a_cols, raw = a_rows[ok], a_cols[ok], raw[ok]
+        co_cnts = similarity.co_counts(X, a_rows, a_cols)
+        w_sims = similarity.shrink(raw, co_cnts, similarity.SHRINK_ALPHA)
+
+        changed_ids = ids[anchor_cols]
+        new_anchor_ids, new_neighbor_ids = ids[a_rows], ids[a_cols]
+
+        # 4) same swap for the in-memory similarity triple
+        anchor_ids, neighbor_ids, weighted_sims = (np.asarray(a) for a in r.similarities)
+        stay = ~np.isin(anchor_ids, changed_ids)
+        similarities = (
+            np.concatenate([anchor_ids[stay], new_anchor_ids]),
+            np.concatenate([neighbor_ids[stay], new_neighbor_ids]),
+            np.concatenate([np.asarray(weighted_sims, dtype=np.float64)[stay], w_sims]),
+        )
+
+        if write:
+            replace_anchored_similarities(session, changed_ids, new_anchor_ids, new_neighbor_ids, w_sims)
+
+        r.X_csc = X
+        r.supports = supports
+        r.high_support_movies = set(ids[top_items].tolist())
+        r.knn_indices = knn_indices
+        r.knn_sims = knn_sims
+        r.similarities = similarities
+        r.ratings_watermark = watermark
+        r.neighbor_index = NeighborIndex.from_pairs(*similarities)
+        r.build_neighbor_matrix()
+        r.build_long_tail_scorer()
+        # a new version: cached long-tail rows and responses of the old
+        # matrix don't apply (the copy starts with an empty long-tail cache)
+        r.build_version = f"update-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        # the copy is complete, later updates build on it
+        self.recommender = r
+        self.norms2 = norms2
+
+        return {
+            "ratings": int(changed.sum()),
+            "new_movies": int(n_new_movies),
+            "touched": int(len(touched)),
+            "anchors": int(len(anchor_cols)),
+            "pairs": int(len(w_sims)),
+            "watermark": watermark,
+        }
+
+    # pull everything since the watermark and apply it
+    def update(self, session, write=True):
+        return self.apply(session, self.pull(session), write=write)
+
+    # one update on its own session, for the background task in app.py
+    def update_once(self, write=True):
+        session = next(get_db())
+        try:
+            return self.update(session, write=write)
+        finally:
+            session.close()
@@ -0,0 +1,314 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+
+
+# which backend calculate_similarities uses: "brute" or "blocked" (exact),
+# or "lsh" (approximate)
+KNN_BACKEND = os.getenv("KNN_BACKEND", "brute")
+
+# LSH tuning: more tables / wider windows -> higher recall, slower build
+LSH_TABLES = int(os.getenv("LSH_TABLES", "8"))
+LSH_BITS = int(os.getenv("LSH_BITS", "16"))
+LSH_WINDOW = int(os.getenv("LSH_WINDOW", "256"))
+
+# blocked exact kNN: worker processes and the peak memory budget they share
+KNN_WORKERS = int(os.getenv("KNN_WORKERS", str(os.cpu_count() or 1)))
+KNN_MAX_MEMORY_MB = int(os.getenv("KNN_MAX_MEMORY_MB", "1024"))
+
+
+# rows scaled to unit length, so a dot product is a cosine similarity
+def l2_normalize(item_features, dtype=np.float32):
+    X = item_features.tocsr().astype(dtype)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return (diags(1.0 / norms) @ X).tocsr()
+
+
+# exact cosine kNN over all items. returns (distances, indices), both of
+# shape (n_items, n_neighbors), closest first
+def brute_knn(item_features, n_neighbors):
+    nn = NearestNeighbors(
+        n_neighbors=n_neighbors,
+        metric="cosine",
+        algorithm="brute",
+        n_jobs=-1,
+    )
+    nn.fit(item_features)
+    return nn.kneighbors(item_features, return_distance=True)
+
+
+# keep the best n_neighbors unique candidates per row. candidate id -1 is empty.
+def _merge_candidates(cand_ids, cand_sims, n_neighbors):
+    n_items = cand_ids.shape[0]
+    rows = np.arange(n_items)[:, None]
+
+    # drop repeated candidates (found by several tables) by id-sorting each row
+    by_id = np.argsort(cand_ids, axis=1, kind="stable")
+    cand_ids = cand_ids[rows, by_id]
+    cand_sims = cand_sims[rows, by_id]
+
+    # the item itself always comes first, like the exact backend
+    cand_sims[cand_ids == np.arange(n_items)[:, None]] = np.inf
+
+    repeated = np.zeros(cand_ids.shape, dtype=bool)
+    repeated[:, 1:] = cand_ids[:, 1:] == cand_ids[:, :-1]
+    cand_sims[repeated | (cand_ids < 0)] = -np.inf
+
+    width = min(n_neighbors, cand_ids.shape[1])
+    top = np.argpartition(-cand_sims, width - 1, axis=1)[:, :width]
+    order = np.argsort(-cand_sims[rows, top], axis=1, kind="stable")
+    top = top[rows, order]
+
+    indices = cand_ids[rows, top]
+    sims = cand_sims[rows, top]
+    sims[np.isposinf(sims)] = 1.0
+
+    # rows with too few candidates are padded with the item itself at
+    # similarity 0, which knn_pairs drops as a self pair
+    missing = np.isneginf(sims)
+    indices[missing] = np.broadcast_to(np.arange(n_items)[:, None], indices.shape)[missing]
+    sims[missing] = 0.0
+    if width < n_neighbors:
+        pad = n_neighbors - width
+        indices = np.hstack([indices, np.repeat(np.arange(n_items)[:, None], pad, axis=1)])
+        sims = np.hstack([sims, np.zeros((n_items, pad))])
+    return 1.0 - sims, indices
+
+
+# approximate cosine kNN with random-projection LSH.
+# each table hashes items to n_bits sign bits of random projections and
+# sorts them by hash, so items sharing long hash prefixes end up adjacent.
+# exact similarities are then computed inside fixed windows of that order
+# and the best candidates over all tables are kept.
+def lsh_knn(item_features, n_neighbors, n_tables=LSH_TABLES, n_bits=LSH_BITS, window=LSH_WINDOW, seed=0):
+    X = l2_normalize(item_features)
+    n_items, n_dims = X.shape
+    rng = np.random.default_rng(seed)
+    weights = np.left_shift(np.uint64(1), np.arange(n_bits, dtype=np.uint64))
+
+    per_table = min(n_neighbors, window)
+    cand_ids = np.full((n_items, n_tables * per_table), -1, dtype=np.int64)
+    cand_sims = np.full((n_items, n_tables * per_table), -np.inf, dtype=np.float64)
+
+    for t in range(n_tables):
+        planes = rng.standard_normal((n_dims, n_bits)).astype(np.float32)
+        bits = np.asarray(X @ planes) > 0
+        codes = bits.astype(np.uint64) @ weights
+        order = np.argsort(codes, kind="stable")
+
+        # shift every other table by half a window so window edges move
+        offset = (window // 2) if t % 2 else 0
+        bounds = list(range(offset, n_items, window))
+        if not bounds or bounds[0] != 0:
+            bounds.insert(0, 0)
+        bounds.append(n_items)
+
+        col = t * per_table
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            idx = order[start:stop]
+            if len(idx) == 0:
+                continue
+            block = X[idx]
+            sims = (block @ block.T).toarray()
+            np.fill_diagonal(sims, np.inf)  # keep every item in its own list
+            width = min(per_table, len(idx))
+            top = np.argpartition(-sims, width - 1, axis=1)[:, :width]
+            cand_ids[idx, col:col + width] = idx[top]
+            cand_sims[idx, col:col + width] = np.take_along_axis(sims, top, axis=1)
+
+    return _merge_candidates(cand_ids, cand_sims, n_neighbors)
+
+
+# dense (block, n_items) float64 temporaries alive per query row in a block:
+# similarities, distances, clipped distances and the argpartition indices
+_BLOCK_ARRAYS = 4
+
+
+# rows of the query matrix handled per block so that every worker's
+# temporaries plus the shared inputs stay under max_memory bytes
+def block_rows(n_items, shared_bytes, n_workers, max_memory):
+    per_row = n_items * 8 * _BLOCK_ARRAYS
+    budget = max_memory - shared_bytes
+    rows = budget // (max(n_workers, 1) * per_row)
+    if rows < 1:
+        raise MemoryError(
+            f"kNN needs at least {shared_bytes + n_workers * per_row} bytes "
+            f"with {n_workers} workers, the ceiling is {max_memory}"
+        )
+    return int(min(rows, n_items))
+
+
+# exact top-k for query rows [start, stop), computed the same way as
+# NearestNeighbors(metric="cosine", algorithm="brute"): 1 - cosine clipped to
+# [0, 2], then argpartition and argsort of each row
+def _knn_block(X_norm, Y_norm_T, start, stop, n_neighbors):
+    dist = (X_norm[start:stop] @ Y_norm_T).toarray()
+    dist *= -1
+    dist += 1
+    dist = np.clip(dist, 0.0, 2.0)
+
+    sample_range = np.arange(dist.shape[0])[:, None]
+    neigh_ind = np.argpartition(dist, n_neighbors - 1, axis=1)
+    neigh_ind = neigh_ind[:, :n_neighbors]
+    neigh_ind = neigh_ind[sample_range, np.argsort(dist[sample_range, neigh_ind])]
+    return dist[sample_range, neigh_ind], neigh_ind
+
+
+# worker side: sparse inputs are rebuilt on top of the parent's shared memory
+_shared = {}
+
+
+# pool workers share the parent's resource tracker, and the parent
+# unlinks every segment once the pool is done
+def _attach(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(specs, n_neighbors):
+    matrices = {}
+    for key, (shape, parts) in specs.items():
+        arrays = []
+        for name, part_shape, dtype in parts:
+            shm, arr = _attach(name, part_shape, dtype)
+            _shared.setdefault("segments", []).append(shm)
+            arrays.append(arr)
+        data, indices, indptr = arrays
+        matrices[key] = csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    _shared["X_norm"] = matrices["X_norm"]
+    _shared["Y_norm_T"] = matrices["Y_norm_T"]
+    _shared["n_neighbors"] = n_neighbors
+
+
+def _run_block(bounds):
+    start, stop = bounds
+    return start, _knn_block(_shared["X_norm"], _shared["Y_norm_T"], start, stop, _shared["n_neighbors"])
+
+
+def _share(matrix, segments):
+    parts = []
+    for arr in (matrix.data, matrix.indices, matrix.indptr):
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        segments.append(shm)
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        parts.append((shm.name, arr.shape, arr.dtype.str))
+    return matrix.shape, parts
+
+
+# exact cosine kNN that bounds peak memory. item vectors are L2-normalized
+# once, query items are processed in fixed-size blocks (one sparse x
+# sparse-transpose product + argpartition each) and blocks are spread over
+# a process pool that reads the normalized matrix from shared memory.
+# results are identical to brute_knn.
+def blocked_knn(item_features, n_neighbors, n_workers=KNN_WORKERS, max_memory_mb=KNN_MAX_MEMORY_MB, block_size=None):
+    X_norm = normalize(csr_matrix(item_features, dtype=np.float64), copy=True)
+    Y_norm_T = X_norm.T.tocsr()
+    n_items = X_norm.shape[0]
+
+    shared_bytes = sum(
+        m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in (X_norm, Y_norm_T)
+    )
+    n_workers = max(1, min(n_workers, n_items))
+    if block_size is None:
+        block_size = block_rows(n_items, shared_bytes, n_workers, max_memory_mb * 1024 * 1024)
+    blocks = [(start, min(start + block_size, n_items)) for start in range(0, n_items, block_size)]
+
+    distances = np.empty((n_items, n_neighbors), dtype=np.float64)
+    indices = np.empty((n_items, n_neighbors), dtype=np.int64)
+
+    if n_workers == 1 or len(blocks) == 1:
+        for start, stop in blocks:
+            distances[start:stop], indices[start:stop] = _knn_block(X_norm, Y_norm_T, start, stop, n_neighbors)
+        return distances, indices
+
+    segments = []
+    try:
+        specs = {
+            "X_norm": _share(X_norm, segments),
+            "Y_norm_T": _share(Y_norm_T, segments),
+        }
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(specs, n_neighbors),
+        ) as pool:
+            for start, (dist, ind) in pool.map(_run_block, blocks):
+                stop = start + len(ind)
+                distances[start:stop] = dist
+                indices[start:stop] = ind
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+    return distances, indices
+
+
+BACKENDS = {
+    "brute": brute_knn,
+    "blocked": blocked_knn,
+    "lsh": lsh_knn,
+}
+
+
+def kneighbors(item_features, n_neighbors, backend=None, **params):
+    backend = backend or KNN_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown kNN backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend](item_features, n_neighbors, **params)
+
+
+# fraction of approximate neighbors (self excluded) that are at least as
+# close as the exact k-th neighbor. compared on distances rather than ids,
+# since many sparse items tie at the same distance and exact ids among
+# ties are arbitrary.
+def recall_at_k(exact_distances, approx_distances, tol=1e-6):
+    kth = exact_distances[:, -1:]
+    return float((approx_distances[:, 1:] <= kth + tol).mean())
+
+
+# time a backend against the exact one and report its recall
+def compare_backends(item_features, n_neighbors, backend="lsh", **params):
+    start = time.perf_counter()
+    exact, _ = brute_knn(item_features, n_neighbors)
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx, _ = kneighbors(item_features, n_neighbors, backend=backend, **params)
+    approx_seconds = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "params": params,
+        "n_items": item_features.shape[0],
+        "n_neighbors": n_neighbors,
+        "exact_seconds": exact_seconds,
+        "approx_seconds": approx_seconds,
+        "recall": recall_at_k(exact, approx),
+    }
+
+
+# python -m recommender.knn [data folder]
+# prints the LSH recall/timing against brute force for a few settings
+if __name__ == "__main__":
+    from recommender import loader, encoding
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data", "ml-latest-small"
+    )
+    ratings = loader.load_ratings(folder)
+    users, _ = encoding.encode_ids(ratings["userId"].to_numpy())
+    items, _ = encoding.encode_ids(ratings["movieId"].to_numpy())
+    item_features = csr_matrix(
+        (ratings["rating"].to_numpy(dtype=np.float64), (items, users))
+    )
+
+    for n_tables, window in [(4, 128), (8, 256), (16, 512)]:
+        report = compare_backends(item_features, 11, n_tables=n_tables, window=window)
+        print(report)
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+
+
+RATING_DTYPES = {
+    "userId": np.int32,
+    "movieId": np.int32,
+    "rating": np.float32,
+    "timestamp": np.int64,
+}
+MOVIE_DTYPES = {"movieId": np.int32, "title": str, "genres": str}
+
+CHUNKSIZE = 1_000_000
+CACHE_DIR = "ratings_cache"
+CACHE_SOURCE = "source.json"
+
+logger = logging.getLogger(__name__)
+
+
+# MovieLens ratings are half stars, so rating * 2 always fits in a uint8
+def encode_ratings(ratings):
+    return np.rint(np.asarray(ratings) * 2).astype(np.uint8)
+
+
+def decode_ratings(half_stars):
+    return np.asarray(half_stars).astype(np.float32) / 2
+
+
+# size + mtime of the csv, used to tell whether the columnar cache is stale
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _columns(keep_timestamp):
+    columns = ["userId", "movieId", "rating"]
+    if keep_timestamp:
+        columns.append("timestamp")
+    return columns
+
+
+# streams ratings.csv in chunks into flat COO-style column arrays
+def read_ratings_csv(csv_path, keep_timestamp=False, chunksize=CHUNKSIZE):
+    columns = _columns(keep_timestamp)
+    parts = {name: [] for name in columns}
+    reader = pd.read_csv(
+        csv_path,
+        usecols=columns,
+        dtype={name: RATING_DTYPES[name] for name in columns},
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        for name in columns:
+            parts[name].append(chunk[name].to_numpy())
+
+    arrays = {
+        name: np.concatenate(chunks) if chunks else np.zeros(0, dtype=RATING_DTYPES[name])
+        for name, chunks in parts.items()
+    }
+    arrays["rating"] = encode_ratings(arrays["rating"])
+    return arrays
+
+
+def read_ratings_cache(cache_path, csv_path, keep_timestamp=False):
+    try:
+        with open(os.path.join(cache_path, CACHE_SOURCE)) as f:
+            source = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if source != _source_stamp(csv_path):
+        return None
+
+    arrays = {}
+    for name in _columns(keep_timestamp):
+        file = os.path.join(cache_path, f"{name}.npy")
+        if not os.path.exists(file):
+            return None
+        arrays[name] = np.load(file)
+    return arrays
+
+
+def write_ratings_cache(cache_path, csv_path, arrays):
+    tmp_path = f"{cache_path}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(tmp_path)
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), arr)
+        with open(os.path.join(tmp_path, CACHE_SOURCE), "w") as f:
+            json.dump(_source_stamp(csv_path), f)
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+        os.rename(tmp_path, cache_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+# ratings as a compact DataFrame: int32 ids, float32 ratings and, only if
+# asked for, int64 timestamps. the first load writes a columnar .npy copy
+# next to the csv (ratings stored as uint8 half stars) which later loads
+# read instead of parsing the csv again.
+def load_ratings(data_folder, keep_timestamp=False, chunksize=CHUNKSIZE, use_cache=True):
+    csv_path = os.path.join(data_folder, "ratings.csv")
+    cache_path = os.path.join(data_folder, CACHE_DIR)
+
+    arrays = read_ratings_cache(cache_path, csv_path, keep_timestamp) if use_cache else None
+    if arrays is None:
+        arrays = read_ratings_csv(csv_path, keep_timestamp, chunksize)
+        if use_cache:
+            try:
+                write_ratings_cache(cache_path, csv_path, arrays)
+            except OSError as e:
+                # read-only deploys still work, they just parse the csv each time
+                logger.warning('Could not write ratings cache to %s: %s', cache_path, e)
+    else:
+        logger.info('Read ratings from cache %s', cache_path)
+
+    arrays["rating"] = decode_ratings(arrays["rating"])
+    return pd.DataFrame(arrays, copy=False)
+
+
+def load_movies(data_folder):
+    return pd.read_csv(os.path.join(data_folder, "movies.csv"), dtype=MOVIE_DTYPES)
@@ -0,0 +1,134 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+
+# root level, plus per-logger overrides: "recommender.db=DEBUG,sqlalchemy.engine=INFO"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json" for one JSON object per line, "text" for humans
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# share of hot-path debug events (per seed / per query) that get logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# id of the request being handled, set by the app middleware. workers.py
+# copies the context into executor threads, so it follows the request there
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that aren't user supplied extra={...} fields
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # the stock prepare() formats the whole record, traceback included, into
+    # msg. keep the message and the traceback apart for the JSON formatter
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, "request_id", None):
+            line = f"{line} request_id={record.request_id}"
+        extra = {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+        if extra:
+            line = f"{line} " + " ".join(f"{k}={v}" for k, v in extra.items())
+        return line
+
+
+def _levels(spec):
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, level = item.partition("=")
+        yield name.strip(), level.strip().upper()
+
+
+# routes every log record through a queue: the calling thread only enqueues
+# the record, formatting and writing to stdout happen on the listener thread.
+# safe to call more than once
+def setup_logging(level=LOG_LEVEL, levels=LOG_LEVELS, fmt=LOG_FORMAT, stream=None):
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    # the request id has to be read on the request's thread, not the listener's
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    for name, name_level in _levels(levels):
+        logging.getLogger(name).setLevel(name_level)
+
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+# flush what's queued and stop the listener thread
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# debug log for hot-path events: only LOG_SAMPLE_RATE of the calls are
+# logged, and nothing is formatted unless debug is on for the logger
+def debug_sampled(logger, msg, *args, rate=None, **fields):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    if rate < 1.0 and random.random() >= rate:
+        return
+    logger.debug(msg, *args, extra={**fields, "sample_rate": rate})
+
@@ -0,0 +1,193 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+
+# latency buckets in seconds, from sub-millisecond lookups to slow rebuilds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# every metric created below, in registration order, for render()
+_metrics = []
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    # drop every label set, e.g. the old version of an info gauge
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((k, v) for k, v in self._values.items() if v is not None)
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    # with HIST.time(stage="score"): ...
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((k, (list(counts), total)) for k, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# decorator form of Histogram.time
+def timed(histogram, **labels):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# every metric in the Prometheus text exposition format
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# request path
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_SECONDS = Histogram("http_request_seconds", "HTTP request latency by route.", ("method", "route"))
+
+# recommendation pipeline: jwt_decode, seed_rows, score, render, ...
+STAGE_SECONDS = Histogram("recommend_stage_seconds", "Time spent per recommendation pipeline stage.", ("stage",))
+SEEDS = Counter("recommend_seeds_total", "Seed movies scored, by how their neighbors were found.", ("source",))
+
+# /recommend response cache: hit, shared_hit, coalesced (waited on an
+# identical in-flight request) or miss
+RESPONSE_CACHE = Counter("response_cache_lookups_total", "Recommendation response cache lookups by result.", ("result",))
+
+# /recommend admission: cost cheap or expensive, outcome full, queue_full or
+# deadline (the last two answered from high-support seeds only)
+ADMISSION = Counter("recommend_admissions_total", "Recommendation requests by cost class and outcome.", ("cost", "outcome"))
+LONG_TAIL_PENDING = Gauge("long_tail_pending", "Long-tail similarity computations queued or running.")
+
+# database calls made on the request path
+DB_SECONDS = Histogram("db_query_seconds", "Database call latency by query.", ("query",))
+DB_ROWS = Counter("db_rows_fetched_total", "Rows read from the database by query.", ("query",))
+
+# long-tail similarity cache, copied from LRUCache.stats() at scrape time
+LONG_TAIL_CACHE = Gauge("long_tail_cache", "Long-tail similarity cache counters.", ("stat",))
+
+# serving model, set at scrape time
+MODEL_INFO = Gauge("model_info", "Serving model version and engine (always 1).", ("version", "engine"))
+MODEL_ITEMS = Gauge("model_items", "Movies (utility matrix columns) in the serving model.")
+MODEL_USERS = Gauge("model_users", "Users (utility matrix rows) in the serving model.")
+MODEL_NNZ = Gauge("model_ratings", "Ratings (non-zeros) in the serving model's utility matrix.")
+MODEL_NEIGHBORS = Gauge("model_neighbor_pairs", "Directed neighbor pairs in the serving model's index.")
+MODEL_BUILT_AT = Gauge("model_built_at_seconds", "Unix time the serving model was built.")
+MODEL_BYTES = Gauge("model_bytes", "Bytes held by the serving model's arrays.")
+RESIDENT_BYTES = Gauge("process_resident_memory_bytes", "Resident set size of this process.")
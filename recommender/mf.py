@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+# which engine recommend_movies scores with: "knn" (item-item neighbors)
+# or "als" (matrix factorization, scores the whole catalog)
+RECOMMENDER_ENGINE = os.getenv("RECOMMENDER_ENGINE", "knn")
+ENGINES = ("knn", "als")
+
+# ALS tuning: latent factors, L2 weight (scaled by each row's rating count)
+# and alternating sweeps
+MF_FACTORS = int(os.getenv("MF_FACTORS", "64"))
+MF_REG = float(os.getenv("MF_REG", "0.1"))
+MF_ITERATIONS = int(os.getenv("MF_ITERATIONS", "10"))
+MF_THREADS = int(os.getenv("MF_THREADS", str(os.cpu_count() or 1)))
+# padded ratings per batched solve, bounds a batch's gathered factors to
+# about MF_BATCH_NNZ * MF_FACTORS * 4 bytes
+MF_BATCH_NNZ = int(os.getenv("MF_BATCH_NNZ", "65536"))
+# items with fewer ratings are never recommended by ALS, their factors are
+# mostly regularization
+MF_MIN_SUPPORT = int(os.getenv("MF_MIN_SUPPORT", "5"))
+
+
+# split the rows with ratings into batches of about batch_nnz padded
+# ratings. rows are sorted by rating count first, so padding every row of a
+# batch to its longest row wastes little. rows with more ratings than
+# batch_nnz get a batch of their own
+def _batches(indptr, batch_nnz):
+    counts = np.diff(indptr)
+    rows = np.flatnonzero(counts)
+    rows = rows[np.argsort(counts[rows], kind="stable")]
+    batches = []
+    start = 0
+    while start < len(rows):
+        # counts ascend, so the last row of a batch is its longest
+        stop = start + 1
+        while stop < len(rows) and (stop - start + 1) * counts[rows[stop]] <= batch_nnz:
+            stop += 1
+        batches.append(rows[start:stop])
+        start = stop
+    return batches
+
+
+# least squares for every row of R given the other side's factors Y:
+# x_r = (Y_r^T Y_r + reg * n_r * I)^-1 Y_r^T r
+def _solve_rows(R, Y, reg, batches, pool):
+    n_rows, f = R.shape[0], Y.shape[1]
+    out = np.zeros((n_rows, f), dtype=np.float32)
+    eye = np.eye(f, dtype=np.float64)
+    counts = np.diff(R.indptr)
+
+    def solve_batch(rows):
+        n = counts[rows]
+        width = n[-1]
+        # (batch, width, f) factors of every row's rated columns, zero padded
+        slot = np.arange(width)
+        valid = slot[None, :] < n[:, None]
+        pos = (R.indptr[rows][:, None] + slot[None, :])[valid]
+        Yg = np.zeros((len(rows), width, f), dtype=np.float32)
+        Yg[valid] = Y[R.indices[pos]]
+        r = np.zeros((len(rows), width, 1), dtype=np.float32)
+        r[valid, 0] = R.data[pos]
+
+        Yt = Yg.transpose(0, 2, 1)
+        A = (Yt @ Yg).astype(np.float64)
+        A += reg * n[:, None, None] * eye
+        out[rows] = np.linalg.solve(A, (Yt @ r).astype(np.float64))[:, :, 0]
+
+    list(pool.map(solve_batch, batches))
+    return out
+
+
+class ALSModel:
+    """
+    Explicit-rating matrix factorization, trained with alternating least
+    squares on the utility matrix (ratings minus the global mean).
+
+    Only the item factors are kept. At request time the seeds are folded
+    in as one small least-squares solve and the whole catalog is scored
+    with a single matrix-vector product.
+    """
+
+    def __init__(self, item_factors, global_mean, reg=MF_REG, candidates=None):
+        self.item_factors = item_factors
+        self.global_mean = float(global_mean)
+        self.reg = reg
+        # items that may be recommended, see MF_MIN_SUPPORT
+        if candidates is None:
+            candidates = np.ones(len(item_factors), dtype=bool)
+        self.candidates = candidates
+
+    # X: (n_users, n_items) utility matrix, csr or csc
+    @classmethod
+    def fit(cls, X, factors=MF_FACTORS, reg=MF_REG, iterations=MF_ITERATIONS,
+            threads=MF_THREADS, batch_nnz=MF_BATCH_NNZ, candidates=None, seed=0):
+        X = X.tocsr().astype(np.float32)
+        global_mean = float(X.data.mean()) if X.nnz else 0.0
+        X.data -= global_mean
+        Xt = X.T.tocsr()
+
+        user_batches = _batches(X.indptr, batch_nnz)
+        item_batches = _batches(Xt.indptr, batch_nnz)
+
+        rng = np.random.default_rng(seed)
+        V = rng.normal(0.0, 0.1, (X.shape[1], factors)).astype(np.float32)
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            for _ in range(iterations):
+                U = _solve_rows(X, V, reg, user_batches, pool)
+                V = _solve_rows(Xt, U, reg, item_batches, pool)
+        return cls(V, global_mean, reg, candidates)
+
+    # user factors for a seed list of (cols, ratings)
+    def fold_in(self, cols, ratings):
+        cols = np.asarray(cols, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        # columns added by incremental updates have no factors yet
+        known = (cols >= 0) & (cols < len(self.item_factors))
+        cols, ratings = cols[known], ratings[known]
+        f = self.item_factors.shape[1]
+        if not len(cols):
+            return np.zeros(f)
+        Ys = self.item_factors[cols].astype(np.float64)
+        A = Ys.T @ Ys + self.reg * len(cols) * np.eye(f)
+        return np.linalg.solve(A, Ys.T @ (ratings - self.global_mean))
+
+    # best n (cols, scores) per seed list of (cols, ratings), highest first.
+    # seeds and non-candidates are never returned
+    def top_n(self, seed_lists, n):
+        if not seed_lists:
+            return []
+        users = np.stack([self.fold_in(cols, ratings) for cols, ratings in seed_lists], axis=1)
+        # (n_items, n_lists), one product for every list
+        scores = self.item_factors @ users.astype(np.float32)
+
+        results = []
+        for u, (cols, _) in enumerate(seed_lists):
+            if not np.any(users[:, u]):
+                results.append((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)))
+                continue
+            mask = self.candidates.copy()
+            cols = np.asarray(cols, dtype=np.int64)
+            mask[cols[(cols >= 0) & (cols < len(mask))]] = False
+            candidates = np.flatnonzero(mask)
+            vals = scores[candidates, u]
+            if n < len(vals):
+                top = np.argpartition(-vals, n - 1)[:n]
+                candidates, vals = candidates[top], vals[top]
+            order = np.argsort(-vals, kind="stable")
+            results.append((candidates[order], vals[order]))
+        return results
@@ -1,17 +1,23 @@
 from sqlalchemy import (
+    BigInteger,
     Column,
     Integer,
     Float,
+    REAL,
     ForeignKey,
     Index,
     String,
     Boolean,
+    Sequence,
     desc
 )
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
+# change sequence of the ratings table (postgres; sqlite uses max + 1)
+RATING_SEQ = Sequence("ratings_seq", metadata=Base.metadata)
+
 # class Movie(Base):
 #     __tablename__ = "movies"
 #     id    = Column(Integer, primary_key=True)
@@ -29,11 +35,16 @@ Base = declarative_base()
 
 
 
+# every pair is stored in both directions, so the neighbors of a movie are
+# one range scan of (movie_id, weighted_sim DESC)
 class MovieSimilarity(Base):
     __tablename__ = "movie_similarities"
     movie_id     = Column(Integer, primary_key=True)
     neighbor_id  = Column(Integer, primary_key=True)
-    weighted_sim = Column(Float,  nullable=False)
+    weighted_sim = Column(REAL,  nullable=False)
+    # NULL for the kNN build; long-tail rows written back by a replica
+    # (LONG_TAIL_WRITE_BACK) carry the model version they were computed from
+    build_version = Column(String, nullable=True)
 
     def __repr__(self):
         return f"<MovieSimilarity({self.movie_id} → {self.neighbor_id}, sim={self.weighted_sim:.4f})>"
@@ -64,5 +75,24 @@ class Rating(Base):
     movie_id = Column(Integer, nullable=False)
     value = Column(Float, nullable=False)
     timestamp = Column(Integer)
+    # set by the database on every insert and update (see db._rating_upsert),
+    # the incremental updater's watermark
+    seq = Column(BigInteger, index=True)
 
     user = relationship("User", back_populates="ratings")
+
+    __table_args__ = (
+        # one rating per user and movie; also serves lookups by user_id
+        Index("ix_ratings_user_id_movie_id", "user_id", "movie_id", unique=True),
+    )
+
+
+# precomputed top-N recommendations per user, written by bulk_recommend.py
+class UserRecommendation(Base):
+    __tablename__ = "user_recommendations"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    movie_id = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+    build_version = Column(String, nullable=True)
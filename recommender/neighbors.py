@@ -0,0 +1,95 @@
+from collections import namedtuple
+import numpy as np
+from recommender.models import MovieSimilarity
+
+
+# same shape as a MovieSimilarity row, without the ORM overhead.
+# movie_id is always the queried movie and neighbor_id the other end.
+Neighbor = namedtuple("Neighbor", ["movie_id", "neighbor_id", "weighted_sim"])
+
+
+class NeighborIndex:
+    """
+    CSR-style top-K neighbor table. Neighbors of movie_ids[r] live in
+    neighbor_ids[offsets[r]:offsets[r + 1]], sorted by score descending.
+    Both directions of every stored pair are present.
+    """
+
+    def __init__(self, movie_ids, offsets, neighbor_ids, scores):
+        self.movie_ids = movie_ids
+        self.offsets = offsets
+        self.neighbor_ids = neighbor_ids
+        self.scores = scores
+
+    # build from the calculate_similarities triple, where each unordered
+    # pair appears once: both directions are added here
+    @classmethod
+    def from_pairs(cls, anchor_ids, neighbor_ids, weighted_sims):
+        anchor_ids = np.asarray(anchor_ids, dtype=np.int64)
+        neighbor_ids = np.asarray(neighbor_ids, dtype=np.int64)
+        weighted_sims = np.asarray(weighted_sims, dtype=np.float32)
+        return cls.from_directed(
+            np.concatenate([anchor_ids, neighbor_ids]),
+            np.concatenate([neighbor_ids, anchor_ids]),
+            np.concatenate([weighted_sims, weighted_sims]),
+        )
+
+    # build from rows that already hold both directions
+    @classmethod
+    def from_directed(cls, src, dst, sims):
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        sims = np.asarray(sims, dtype=np.float32)
+
+        # group by source, best score first
+        order = np.lexsort((-sims, src))
+        src, dst, sims = src[order], dst[order], sims[order]
+
+        movie_ids, counts = np.unique(src, return_counts=True)
+        offsets = np.zeros(len(movie_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(movie_ids, offsets, dst, sims)
+
+    # build once from the movie_similarities table (both directions stored).
+    # long-tail rows written back by replicas aren't part of the kNN build
+    @classmethod
+    def from_db(cls, session):
+        rows = session.query(
+            MovieSimilarity.movie_id,
+            MovieSimilarity.neighbor_id,
+            MovieSimilarity.weighted_sim,
+        ).filter(MovieSimilarity.build_version.is_(None)).all()
+        if not rows:
+            return cls.from_directed([], [], [])
+        src, dst, sims = zip(*rows)
+        return cls.from_directed(src, dst, sims)
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, movie_id):
+        return self.row(movie_id) >= 0
+
+    # row of movie_id in the index, -1 if it has no stored neighbors
+    def row(self, movie_id):
+        r = int(np.searchsorted(self.movie_ids, movie_id))
+        if r < len(self.movie_ids) and self.movie_ids[r] == movie_id:
+            return r
+        return -1
+
+    # (neighbor_ids, scores) arrays for the k best neighbors of movie_id
+    def neighbors(self, movie_id, k=None):
+        r = self.row(movie_id)
+        if r < 0:
+            return self.neighbor_ids[:0], self.scores[:0]
+        start, stop = self.offsets[r], self.offsets[r + 1]
+        if k is not None:
+            stop = min(stop, start + k)
+        return self.neighbor_ids[start:stop], self.scores[start:stop]
+
+    def topk(self, movie_id, k):
+        ids, scores = self.neighbors(movie_id, k)
+        return [
+            Neighbor(int(movie_id), int(n_id), float(w_sim))
+            for n_id, w_sim in zip(ids, scores)
+        ]
@@ -1,17 +1,22 @@
-import pandas as pd
 import numpy as np
 from scipy.sparse import csr_matrix
-from scipy.spatial.distance import cosine
 from dotenv import load_dotenv
-from sklearn.neighbors import NearestNeighbors
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import or_
-import heapq
+import copy
+import logging
 import os
-from recommender.models import MovieSimilarity, Rating
-from recommender.db import get_db, insert_rating_in_db
-from recommender.helpers import normalize
-from collections import namedtuple
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from recommender.models import Rating
+from recommender.db import SessionLocal, insert_rating_in_db, upsert_ratings, get_similarities, insert_long_tail_similarities
+from recommender import similarity, artifact, loader, encoding, knn, scoring, search, mf
+from recommender.metrics import STAGE_SECONDS, SEEDS, DB_SECONDS, DB_ROWS
+from recommender.log import debug_sampled
+from recommender.neighbors import NeighborIndex, Neighbor
+from recommender.cache import LRUCache
+from recommender.catalog import Catalog
 
 
 
@@ -24,12 +29,26 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 small = 'data/ml-latest-small'
 big = 'data/ml-32m'
 
+# long-tail similarity cache: entries, seconds to live (0 = no expiry),
+# and whether computed rows are written back to movie_similarities (tagged
+# with the model version) for replicas serving the same artifact
+LONG_TAIL_CACHE_SIZE = int(os.getenv("LONG_TAIL_CACHE_SIZE", "4096"))
+LONG_TAIL_CACHE_TTL = float(os.getenv("LONG_TAIL_CACHE_TTL", "3600"))
+LONG_TAIL_WRITE_BACK = os.getenv("LONG_TAIL_WRITE_BACK", "false").lower() in ("1", "true", "yes")
+
+# neighbors from movie_similarities instead of the build output: "true"
+# (or "startup") reads the table once into the in-memory index, "request" is
+# the per-request fallback that queries it for every seed
+NEIGHBORS_FROM_DB = os.getenv("NEIGHBORS_FROM_DB", "false").lower()
+
+logger = logging.getLogger(__name__)
 
-Movie = namedtuple("Movie", ["id", "title", "genres"])
 
 
 class MovieRecommender:
-    def __init__(self, folder=small):
+    # build=False only sets up an empty recommender; the caller runs the
+    # stages itself (see benchmarks/run.py)
+    def __init__(self, folder=small, artifact_path=None, build=True):
         # self.db_url = db_url or os.getenv('DATABASE_URL')
         # if not self.db_url:
         #     raise RuntimeError("DATABASE_URL not set")
@@ -38,17 +57,112 @@ class MovieRecommender:
 
         self.folder = folder
         self.ratings = None
-        self.movies = None
-        self.movies_df = None
+        self.catalog = None
         self.high_support_movies = None
+        self.similarities = None
+        self.neighbor_index = None
+        self.neighbor_matrix = None
+        self.neighbors_from_db = NEIGHBORS_FROM_DB == "request"
+        self.neighbors_load_db = NEIGHBORS_FROM_DB in ("1", "true", "yes", "startup")
+        self.knn_backend = knn.KNN_BACKEND
+        # scoring engine behind recommend_movies, RECOMMENDER_ENGINE=als for
+        # matrix factorization. the kNN tables are built either way
+        if mf.RECOMMENDER_ENGINE not in mf.ENGINES:
+            raise ValueError(f"Unknown RECOMMENDER_ENGINE {mf.RECOMMENDER_ENGINE!r}, expected one of {mf.ENGINES}")
+        self.engine = mf.RECOMMENDER_ENGINE
+        self.mf = None
+        self.knn_indices = None
+        self.knn_sims = None
+        # users.id of live (non-import) users, in X row order after the
+        # MovieLens users, and the highest live ratings.seq applied
+        self.live_user_ids = np.zeros(0, dtype=np.int64)
+        self.ratings_watermark = 0
+        self.build_version = None
+        self.built_at = None
+        self.long_tail_cache = LRUCache(LONG_TAIL_CACHE_SIZE, LONG_TAIL_CACHE_TTL or None)
+        self.long_tail_write_back = LONG_TAIL_WRITE_BACK
+        # long-tail rows being computed right now, cache key -> Future
+        self._long_tail_inflight = {}
+        self._long_tail_lock = threading.Lock()
+
+        if not build:
+            return
+
+        logger.info('Initializing recommender')
+        if artifact_path:
+            # serving mode: map a prebuilt artifact instead of retraining
+            self.load_artifact(artifact_path)
+        else:
+            self.import_ratings()
+            self.import_movies()
+            self.calculate_similarities()
+        self.build_indexes()
 
-        self.movie_titles = {}
-        self.movie_inv_titles = {}
-        print("Initializing recommender...")
-        self.import_ratings()
-        self.import_movies()
-        self.calculate_similarities()
-        self.create_mappings()
+
+    # serving structures derived from the matrix and the similarity table
+    def build_indexes(self):
+        if self.neighbors_load_db:
+            self.load_neighbor_index()
+        else:
+            self.neighbor_index = NeighborIndex.from_pairs(*self.similarities)
+            self.build_neighbor_matrix()
+        self.build_long_tail_scorer()
+        self.build_title_search()
+        if self.engine == "als" and self.mf is None:
+            self.build_mf()
+
+
+    # shallow copy to build an updated model next to the serving one. arrays
+    # are shared until the copy replaces them (nothing here modifies them in
+    # place); the long-tail cache and its in-flight table start empty
+    def copy(self):
+        model = copy.copy(self)
+        model.long_tail_cache = LRUCache(self.long_tail_cache.maxsize, self.long_tail_cache.ttl)
+        model._long_tail_inflight = {}
+        model._long_tail_lock = threading.Lock()
+        return model
+
+
+    # write everything needed to serve to a versioned artifact directory
+    def save_artifact(self, path):
+        anchor_ids, neighbor_ids, weighted_sims = self.similarities
+        manifest = artifact.save_artifact(path, self, anchor_ids, neighbor_ids, weighted_sims)
+        self.build_version = manifest["build_version"]
+        return manifest
+
+
+    def load_artifact(self, path):
+        logger.info('Loading artifact from %s', path)
+        manifest, arrays = artifact.load_artifact(path)
+        self.build_version = manifest["build_version"]
+        self.built_at = manifest.get("built_at")
+        self.long_tail_cache.clear()
+
+        self.X_csc = artifact.artifact_matrix(manifest, arrays)
+        self.user_inv_mapper = arrays["user_ids"]
+        self.movie_inv_mapper = arrays["movie_ids"]
+        self.user_mapper = encoding.lookup_array(self.user_inv_mapper)
+        self.movie_mapper = encoding.lookup_array(self.movie_inv_mapper)
+        self.supports = arrays["supports"]
+        self.high_support_movies = set(arrays["high_support_ids"].tolist())
+        self.knn_indices = arrays["knn_indices"]
+        self.knn_sims = arrays["knn_sims"]
+        self.live_user_ids = arrays["live_user_ids"]
+        # artifacts from before ratings.seq start over, re-applying is a no-op
+        self.ratings_watermark = manifest.get("ratings_seq", 0)
+        self.similarities = (
+            arrays["anchor_ids"],
+            arrays["neighbor_ids"],
+            arrays["weighted_sims"],
+        )
+        self.catalog = artifact.artifact_catalog(arrays)
+        if "mf_item_factors" in arrays:
+            self.mf = mf.ALSModel(
+                arrays["mf_item_factors"],
+                manifest["mf"]["global_mean"],
+                manifest["mf"]["reg"],
+                self.mf_candidates(),
+            )
 
 
     def tester(self):
@@ -59,52 +173,57 @@ class MovieRecommender:
         # get the directory where this .py file lives
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         data_folder = os.path.join(BASE_DIR, self.folder)
-        print(f'Reading movies from {data_folder}/movies.csv')
-        self.movies_df = pd.read_csv(os.path.join(data_folder, "movies.csv"))
+        logger.info('Reading movies from %s/movies.csv', data_folder)
+        self.catalog = Catalog.from_frame(loader.load_movies(data_folder))
 
     
     def import_ratings(self):
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         data_folder = os.path.join(BASE_DIR, self.folder)
-        print(f'Reading ratings from {data_folder}/ratings.csv')
-        self.ratings = pd.read_csv(os.path.join(data_folder, "ratings.csv"))
+        logger.info('Reading ratings from %s/ratings.csv', data_folder)
+        # compact dtypes, no timestamps; only needed until the matrix is built
+        self.ratings = loader.load_ratings(data_folder)
 
 
-    def create_mappings(self):
-        movie_list = [
-            Movie(id=row["movieId"], title=row["title"], genres=row["genres"])
-            for _, row in self.movies_df.iterrows()
-        ]
-        self.movies = movie_list
-        self.movie_titles = {movie.id: movie.title for movie in self.movies}
-        self.movie_by_id = {m.id: m for m in self.movies}
-        self.movie_ids = set(self.movie_by_id.keys())
-        # normalize title for easy of search later on
-        self.movie_inv_titles = {normalize(movie.title): movie.id for movie in self.movies}
+    # prefix + fuzzy title index over the catalog, ranked by rating counts
+    def build_title_search(self):
+        movie_ids = self.catalog.ids
+        popularity = np.zeros(len(movie_ids))
+        cols = encoding.indices_of(self.movie_mapper, movie_ids)
+        known = cols >= 0
+        popularity[known] = self.supports[cols[known]]
+        self.title_search = search.TitleSearch(movie_ids, self.catalog.normalized, popularity)
 
 
-    # Generates a sparse utility matrix
+    # Generates a sparse utility matrix.
+    # mappers are arrays: *_inv_mapper[index] = id, *_mapper[id] = index (-1 if unknown)
     def create_X(self, df):
-        M = df['userId'].nunique()
-        N = df['movieId'].nunique()
+        user_index, user_inv_mapper = encoding.encode_ids(df["userId"].to_numpy())
+        item_index, movie_inv_mapper = encoding.encode_ids(df["movieId"].to_numpy())
+        M = len(user_inv_mapper)
+        N = len(movie_inv_mapper)
 
-        user_mapper = dict(zip(np.unique(df["userId"]), list(range(M))))
-        movie_mapper = dict(zip(np.unique(df["movieId"]), list(range(N))))
-        
-        user_inv_mapper = dict(zip(list(range(M)), np.unique(df["userId"])))
-        movie_inv_mapper = dict(zip(list(range(N)), np.unique(df["movieId"])))
-        
-        user_index = [user_mapper[i] for i in df['userId']]
-        item_index = [movie_mapper[i] for i in df['movieId']]
+        user_mapper = encoding.lookup_array(user_inv_mapper)
+        movie_mapper = encoding.lookup_array(movie_inv_mapper)
 
-        X = csr_matrix((df["rating"], (user_index,item_index)), shape=(M,N))
+        # float64 so the kNN distances (and their tie order) match the old build
+        X = csr_matrix((df["rating"].to_numpy(dtype=np.float64), (user_index, item_index)), shape=(M,N))
         
         return X, user_mapper, movie_mapper, user_inv_mapper, movie_inv_mapper
 
 
+    # column of movie_id in the utility matrix, -1 if nobody rated it
+    def movie_col(self, movie_id):
+        return encoding.index_of(self.movie_mapper, movie_id)
+
+
     # calculate similarities for all pairs of movies
     def calculate_similarities(self):
+        if self.ratings is None:
+            self.import_ratings()
         X, user_mapper, movie_mapper, user_inv_mapper, movie_inv_mapper = self.create_X(self.ratings)
+        # the matrix holds everything we need, free the ratings table
+        self.ratings = None
         # movie_titles = dict(zip(self.movies['movieId'], self.movies['title']))
 
         X_csc = X.tocsc()  # shape = (n_users, n_items)
@@ -112,193 +231,218 @@ class MovieRecommender:
         self.X_csc = X_csc
         self.movie_mapper = movie_mapper
         self.movie_inv_mapper = movie_inv_mapper
+        self.user_mapper = user_mapper
+        self.user_inv_mapper = user_inv_mapper
 
         n_items = X_csc.shape[1]
-        # supports[i] = set of user‐indices who rated item i
-        supports = []
-        for i in range(n_items):
-            movie_id = movie_inv_mapper[i]
-            # nonzero()[0] gives the row‐indices of nonzero entries in column i
-            users_who_rated_i = set(X_csc[:, i].nonzero()[0])
-            supports.append((movie_id, users_who_rated_i))
+        item_ids = movie_inv_mapper
 
-        top_n = 10000
-        top_items = sorted(supports, key=lambda x: len(x[1]), reverse=True)[:top_n]
+        # supports[i] = number of users who rated item i
+        supports = similarity.support_counts(X_csc)
+        self.supports = supports
 
+        top_items = similarity.top_support_items(supports, similarity.HIGH_SUPPORT_TOP_N)
+        top_mask = np.zeros(n_items, dtype=bool)
+        top_mask[top_items] = True
 
-        top_movie_ids = set(int(movie_id) for movie_id, _ in top_items)
-        supports_dict = {movie_id: users for movie_id, users in top_items}
+        self.high_support_movies = set(item_ids[top_items].tolist())
 
-        self.high_support_movies = top_movie_ids
+        item_features = X_csc.T  # now shape = (n_items, n_users), still sparse
 
-        
+        K = similarity.K_NEIGHBORS
+        # exact brute force by default, KNN_BACKEND=lsh for approximate
+        distances, indices = knn.kneighbors(item_features, K + 1, backend=self.knn_backend)
+        # every item's neighbor list (rank 0, the item itself, dropped) is
+        # kept for the incremental updater
+        self.knn_indices = indices[:, 1:].astype(np.int32)
+        self.knn_sims = 1.0 - distances[:, 1:].astype(np.float64)
+
+        rows, cols, raw_sims = similarity.knn_pairs(distances, indices, top_mask, item_ids)
+        co_cnts = similarity.co_counts(X_csc, rows, cols)
+        weighted_sims = similarity.shrink(raw_sims, co_cnts, similarity.SHRINK_ALPHA)
+
+        anchor_ids = item_ids[rows].tolist()
+        neighbor_ids = item_ids[cols].tolist()
+        self.similarities = (anchor_ids, neighbor_ids, weighted_sims.tolist())
+        # a fresh build invalidates every cached long-tail row
+        self.build_version = f"build-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.built_at = time.time()
+        self.long_tail_cache.clear()
+        return self.similarities
+    
 
-        item_features = X_csc.T  # now shape = (n_items, n_users), still sparse
- 
-        K = 10
-        nn = NearestNeighbors(
-            n_neighbors=K + 1,
-            metric="cosine",
-            algorithm="brute",
-            n_jobs=-1,
-        )
-        nn.fit(item_features)
+    # items the ALS engine may recommend
+    def mf_candidates(self):
+        return np.asarray(self.supports) >= mf.MF_MIN_SUPPORT
 
-        distances, indices = nn.kneighbors(item_features, return_distance=True)
 
-        alpha = 10  # shrinkage parameter
-        anchor_ids = []
-        neighbor_ids = []
-        # raw_sims   = []
-        # co_counts  = []
-        weighted_sims = []
+    # train the matrix factorization engine on the utility matrix
+    def build_mf(self):
+        logger.info('Training ALS model')
+        started = time.time()
+        self.mf = mf.ALSModel.fit(self.X_csc, candidates=self.mf_candidates())
+        logger.info('Trained ALS model', extra={"seconds": round(time.time() - started, 1)})
 
-        for i in range(n_items):
-            movie_id_i = movie_inv_mapper[i]
-            if movie_id_i not in top_movie_ids:
-                continue
 
-            for rank in range(1, K + 1):
-                j = indices[i][rank]
-                movie_id_j = movie_inv_mapper[j]
-                if movie_id_j not in top_movie_ids:
-                    continue
-
-                if movie_id_i < movie_id_j:
-                    raw_sim = 1.0 - distances[i][rank]
-                    co_cnt = len(supports_dict[movie_id_i] & supports_dict[movie_id_j])
-                    shrink = co_cnt / (co_cnt + alpha)
-                    w_sim = raw_sim * shrink
-
-                    anchor_ids.append(int(movie_id_i))
-                    neighbor_ids.append(int(movie_id_j))
-                    weighted_sims.append(float(w_sim))
-        # return anchor_ids, neighbor_ids, raw_sims, co_counts, weighted_sims
-        return anchor_ids, neighbor_ids, weighted_sims
-    
+    # pre-normalize the high support submatrix used for obscure movies
+    def build_long_tail_scorer(self):
+        high_support_ids = np.fromiter(self.high_support_movies, dtype=np.int64)
+        high_support_cols = np.sort(encoding.indices_of(self.movie_mapper, high_support_ids))
+        self.long_tail = similarity.LongTailScorer(self.X_csc, high_support_cols, self.movie_inv_mapper)
 
-    def high_support_similarities(self, movie_id):
-        print('running high support similarities')
-        # sparse user vector for the rare movie
-        movie_col = self.movie_mapper[movie_id]
-        v = self.X_csc[:, movie_col]  # shape = (n_users, 1)
-
-        alpha = 10 # shrinkage factor
-        sims = []
-        for common_id in self.high_support_movies:
-            j = self.movie_mapper[common_id]
-            vj = self.X_csc[:, j]
-            co_cnt = len(set(v.nonzero()[0]) & set(vj.nonzero()[0]))
-            if co_cnt == 0:
-                continue
-            raw_sim = 1.0 - cosine(v.toarray().ravel(), vj.toarray().ravel())
-            shrink = co_cnt / (co_cnt + alpha)
 
-            sims.append(MovieSimilarity(
-                movie_id=int(movie_id),
-                neighbor_id=int(common_id),
-                weighted_sim=float(raw_sim * shrink)
-            ))
+    # similarities between an obscure movie and the high support movies,
+    # best first. k limits the result to the top k.
+    def high_support_similarities(self, movie_id, k=None):
+        debug_sampled(logger, 'Scoring long-tail movie against high support movies', movie_id=movie_id)
+        movie_col = self.movie_col(movie_id)
+        if movie_col < 0:
+            return []
+        with STAGE_SECONDS.time(stage="long_tail_score"):
+            ids, w_sims = self.long_tail.score(movie_col, k)
+        return [
+            Neighbor(int(movie_id), int(common_id), float(w_sim))
+            for common_id, w_sim in zip(ids, w_sims)
+        ]
+
+
+    # cached high_support_similarities. with write-back enabled, rows another
+    # replica wrote to movie_similarities for the same build version are
+    # reused before computing, and computed rows are written there.
+    def long_tail_similarities(self, session, movie_id, k):
+        key = (self.build_version, movie_id, k)
+        rows = self.long_tail_cache.get(key)
+        if rows is not None:
+            return rows
+
+        # one computation per movie at a time: concurrent callers for the
+        # same movie wait for the first caller's rows
+        with self._long_tail_lock:
+            pending = self._long_tail_inflight.get(key)
+            if pending is None:
+                pending = self._long_tail_inflight[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return pending.result()
+
+        try:
+            rows = self._compute_long_tail(session, movie_id, k)
+            self.long_tail_cache.set(key, rows)
+            pending.set_result(rows)
+            return rows
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._long_tail_lock:
+                del self._long_tail_inflight[key]
+
+
+    def _compute_long_tail(self, session, movie_id, k):
+        write_back = self.long_tail_write_back and session is not None
+        if write_back:
+            stored = get_similarities(session, movie_id, k, build_version=self.build_version)
+            if stored:
+                return [Neighbor(r.movie_id, r.neighbor_id, r.weighted_sim) for r in stored]
+        rows = self.high_support_similarities(movie_id, k)
+        if write_back and rows:
+            try:
+                insert_long_tail_similarities(
+                    session, movie_id,
+                    [r.neighbor_id for r in rows],
+                    [r.weighted_sim for r in rows],
+                    self.build_version,
+                )
+            except Exception:
+                # sharing is best effort, the rows are still served from here
+                logger.warning('Long-tail write-back failed', exc_info=True, extra={"movie_id": movie_id})
+        return rows
+
+
+    # seeds among movie_ids that need a long-tail computation: rated, not
+    # high support and not cached yet. this is what makes a request expensive
+    def long_tail_cost(self, movie_ids, k):
+        if self.engine == "als":
+            return []
+        return [
+            movie_id for movie_id in dict.fromkeys(movie_ids)
+            if movie_id not in self.high_support_movies
+            and self.movie_col(movie_id) >= 0
+            and (self.build_version, movie_id, k) not in self.long_tail_cache
+        ]
+
 
-        # take top-K
-        print('returning:', sims[0])
-        return sorted(sims, key=lambda x: x.weighted_sim, reverse=True)
+    # compute and cache the long-tail rows of one movie ahead of the request
+    # that needs them. runs on a worker thread, so it opens its own session
+    # when rows are written back
+    def warm_long_tail(self, movie_id, k):
+        session = SessionLocal() if self.long_tail_write_back else None
+        try:
+            return self.long_tail_similarities(session, movie_id, k)
+        finally:
+            if session is not None:
+                session.close()
 
 
-    # query database to find movies with highest similarity movies for a given movie id
+    # find movies with highest similarity for a given movie id.
+    # common movies are read from the in-memory neighbor index (loaded from
+    # movie_similarities at startup with NEIGHBORS_FROM_DB=true); with
+    # NEIGHBORS_FROM_DB=request the table is queried instead.
     def topk_movies(self, session, movie_id, k):
         rows = None
         # try:
         # if movie is obscure, compute similarity with common movies only.
-        if movie_id not in self.movies:
-            print('Movie not found in self.movies:', movie_id)
+        if movie_id not in self.catalog:
+            debug_sampled(logger, 'Movie not found in the catalog', movie_id=movie_id)
 
         if movie_id not in self.high_support_movies:
-            print('High support movies:', self.high_support_movies)
-            print('Obscure movie found. Finding similar common movies...')
-            print('Movie ID:', movie_id)
-            rows = self.high_support_similarities(movie_id)[:k]
+            debug_sampled(logger, 'Obscure movie, finding similar common movies', movie_id=movie_id)
+            rows = self.long_tail_similarities(session, movie_id, k)
+        elif not self.neighbors_from_db:
+            rows = self.neighbor_index.topk(movie_id, k)
         else:
-            print('Common movie found...')
-            rows = (
-                session.query(MovieSimilarity)
-                    .filter(
-                        or_(
-                            MovieSimilarity.movie_id   == movie_id,
-                            MovieSimilarity.neighbor_id == movie_id
-                        )
-                        
-                    )
-                    .order_by(MovieSimilarity.weighted_sim.desc())
-                    .all()
-            )
+            debug_sampled(logger, 'Reading neighbors from movie_similarities', movie_id=movie_id)
+            rows = [
+                Neighbor(r.movie_id, r.neighbor_id, r.weighted_sim)
+                for r in get_similarities(session, movie_id, k)
+            ]
+            session.close()
         # except Exception as e:
         #     print('Error:', e)
         #     session.rollback()
-        session.close()
         return rows[:k]
-    
 
-    # find highest rated movies from a set of rated seed movies
-    def find_highly_rated_movies(self, seed_movies):
-        minimum_seed_count = 3
-        high_rating_threshold = 4.0
-        sorted_movies = sorted(seed_movies, key=lambda x: x[1], reverse=True)
-        output = []
-        for i in range(len(sorted_movies)):
-            movie = sorted_movies[i]
-            if movie[1] < high_rating_threshold and len(output) > minimum_seed_count:
-                break
-            output.append(movie[0])
-        return output
 
+    # sparse item -> top-k neighbor matrix for scoring many seed sets at once
+    def build_neighbor_matrix(self, k_per_seed=10):
+        self.neighbor_matrix = scoring.neighbor_matrix(
+            self.neighbor_index, self.movie_mapper, self.X_csc.shape[1], k_per_seed
+        )
 
-    def find_recommended_movies(self, session, seed_ratings, max_results=50, k_per_seed=10):
-        # movies the user already supplied/rated
-        seed_movies = set([x[0] for x in seed_ratings])
-
-        rated_movies = self.find_highly_rated_movies(seed_ratings)  # list of movie_ids
-
-        heap = []
-        lists = []
-
-        # build top-k lists per anchor and prime  heap
-        for i, anchor_id in enumerate(rated_movies):
-            lst = self.topk_movies(session, anchor_id, k_per_seed)  # elements have .movie_id, .neighbor_id, .weighted_sim
-            if not lst:
-                continue
-            lists.append(lst)
-            elem = lst[0]
-            score = -elem.weighted_sim  # min-heap => negative for descending
-            heap.append((score, len(lists) - 1, 0, elem))
-
-        if not heap:
-            return []
-
-        heapq.heapify(heap)
-
-        result = []
-        seen = set(seed_movies)  # start by excluding seeds
-
-        while heap and len(result) < max_results:
-            score, i, j, elem = heapq.heappop(heap)
-
-            # treat the neighbor as the candidate recommendation
-            candidate = elem.neighbor_id
-
-            # exclude seeds and previously yielded items
-            if candidate not in seen:
-                result.append(candidate)
-                seen.add(candidate)
 
-            # advance within list i
-            nxt_index = j + 1
-            if nxt_index < len(lists[i]):
-                nxt = lists[i][nxt_index]
-                nxt_score = -nxt.weighted_sim
-                heapq.heappush(heap, (nxt_score, i, nxt_index, nxt))
+    # load the neighbor index from movie_similarities instead of the build
+    # output, on its own session unless one is passed
+    def load_neighbor_index(self, session=None):
+        logger.info('Loading neighbor index from movie_similarities')
+        own = session is None
+        session = SessionLocal() if own else session
+        try:
+            self.neighbor_index = NeighborIndex.from_db(session)
+        finally:
+            if own:
+                session.close()
+        self.build_neighbor_matrix()
+        self.long_tail_cache.clear()
+    
 
-        return result
+    # top movie ids for one seed list, best first. same kernel as the batch path
+    def find_recommended_movies(self, session, seed_ratings, max_results=50, k_per_seed=10):
+        [(movie_ids, _)] = self.find_batch_recommended_movies(
+            session, [seed_ratings], max_results=max_results, k_per_seed=k_per_seed
+        )
+        return movie_ids.tolist()
 
 
     # recommends k movies based on given titles
@@ -306,7 +450,7 @@ class MovieRecommender:
     def recommend_movies(self, session,  movie_ratings, k=5):
         seed_movies = [(x.id, x.rating) for x in movie_ratings]
         rec_movie_ids = self.find_recommended_movies(session, seed_movies)[:k]
-        rec_movie = [self.movie_titles[x] for x in rec_movie_ids]
+        rec_movie = [self.catalog.title(x) for x in rec_movie_ids]
         return rec_movie_titles # change this to return movie_id and title
     
     def recommend_movies(self, session, movie_ratings, k=5):
@@ -314,28 +458,115 @@ class MovieRecommender:
         seed_movies = [(x.id, x.rating) for x in movie_ratings]
         rec_movie_ids = self.find_recommended_movies(session, seed_movies, max_results=k)
 
+        with STAGE_SECONDS.time(stage="render"):
+            return self.catalog.movies(rec_movie_ids)
 
-        rec_movies = [self.movie_by_id[mid] for mid in rec_movie_ids if mid in self.movie_by_id]
-        return [{"id": m.id, "title": m.title, "genres": m.genres} for m in rec_movies]
+
+    # sparse rows (neighbor cols, sims) for seeds the neighbor matrix can't
+    # answer: obscure movies, or every seed when neighbors_from_db is set
+    def seed_neighbor_rows(self, session, movie_id, k):
+        rows = self.topk_movies(session, movie_id, k)
+        return (
+            encoding.indices_of(self.movie_mapper, [r.neighbor_id for r in rows]),
+            [r.weighted_sim for r in rows],
+        )
+
+
+    # scores many seed lists at once. every list becomes one row of a sparse
+    # user x item matrix holding the seeds' ratings centered on the list's
+    # mean, which is multiplied with the item-neighbor matrix: a candidate
+    # several liked seeds point to scores higher, one next to a disliked seed
+    # lower. seeds and rated movies are masked and the top n taken with
+    # argpartition, so a hundred seeds cost about as much as one.
+    # returns [(movie_ids, scores), ...]
+    def find_batch_recommended_movies(self, session, seed_lists, max_results=50, k_per_seed=10):
+        if self.engine == "als":
+            return self.find_batch_mf_movies(seed_lists, max_results)
+        n_items = self.X_csc.shape[1]
+        seeds, rated, extra = [], [], {}
+        # seeds per neighbor source, for the metrics
+        sources = {"matrix": 0, "long_tail": 0, "db": 0}
+
+        with STAGE_SECONDS.time(stage="seed_rows"):
+            for seed_ratings in seed_lists:
+                known = [(self.movie_col(movie_id), movie_id, rating) for movie_id, rating in seed_ratings]
+                known = [x for x in known if x[0] >= 0]
+                weights = scoring.seed_weights([rating for _, _, rating in known])
+                for col, movie_id, _ in known:
+                    if movie_id not in self.high_support_movies:
+                        sources["long_tail"] += 1
+                    elif self.neighbors_from_db:
+                        sources["db"] += 1
+                    else:
+                        sources["matrix"] += 1
+                        continue
+                    if col not in extra:
+                        extra[col] = self.seed_neighbor_rows(session, movie_id, k_per_seed)
+                seeds.append([(col, w) for (col, _, _), w in zip(known, weights)])
+                rated.append([(col, 1.0) for col, _, _ in known])
+        for source, count in sources.items():
+            if count:
+                SEEDS.inc(count, source=source)
+
+        with STAGE_SECONDS.time(stage="score"):
+            # with neighbors_from_db every seed row comes from the table
+            S = scoring.extra_rows(extra, n_items)
+            if not self.neighbors_from_db:
+                S = self.neighbor_matrix + S if extra else self.neighbor_matrix
+
+            results = scoring.top_n(
+                scoring.seed_matrix(seeds, n_items),
+                S,
+                scoring.seed_matrix(rated, n_items),
+                max_results,
+            )
+        return [(self.movie_inv_mapper[cols], scores) for cols, scores in results]
+
+
+    # ALS version of find_batch_recommended_movies: the seeds are folded
+    # into a user vector and the whole catalog is scored against it
+    def find_batch_mf_movies(self, seed_lists, max_results=50):
+        lists = []
+        for seed_ratings in seed_lists:
+            cols = np.array([self.movie_col(movie_id) for movie_id, _ in seed_ratings], dtype=np.int64)
+            ratings = np.array([rating for _, rating in seed_ratings], dtype=np.float64)
+            lists.append((cols, ratings))
+        with STAGE_SECONDS.time(stage="mf_score"):
+            results = self.mf.top_n(lists, max_results)
+        return [(self.movie_inv_mapper[cols], scores) for cols, scores in results]
+
+
+    # recommendations for many users at once.
+    # expects seed_lists = [[Seed, ...], ...], returns one movie list per seed list
+    def recommend_batch(self, session, seed_lists, k=5):
+        seed_movies = [[(x.id, x.rating) for x in seeds] for seeds in seed_lists]
+        results = self.find_batch_recommended_movies(session, seed_movies, max_results=k)
+        with STAGE_SECONDS.time(stage="render"):
+            return [self.catalog.movies(rec_movie_ids.tolist()) for rec_movie_ids, _ in results]
 
 
     # verifies that the movie exists
     # returns the official title of the movie if exists
     # returns empty string if the movie does not exist 
     def verify_movie_in_db(self, title):
-        normalized_title = normalize(title)
-        exists = normalized_title in self.movie_inv_titles
-        
-        if exists:
-            # fetch official title from movie_titles
+        movie_id = self.catalog.find_title(title)
+
+        if movie_id is not None:
+            # fetch official title from the catalog
             # the title parameter could be an unofficial variation
-            movie_id = self.movie_inv_titles[normalized_title]
-            official_title = self.movie_titles[movie_id]
+            official_title = self.catalog.title(movie_id)
             return official_title
-        print("Movie does not exist")
+        debug_sampled(logger, 'Movie does not exist', title=title)
         return ''
 
 
+    # search-as-you-type / typo tolerant lookup
+    # returns up to `limit` {"id", "title", "genres"} best matches first
+    def search_movies(self, query, limit=10):
+        movie_ids, _ = self.title_search.search(query, limit)
+        return self.catalog.movies(movie_ids.tolist())
+
+
     # def get_user_ratings(self, session, user_id):
     #     try:
     #         ratings = session.query(Rating).filter(Rating.user_id == user_id).all()
@@ -346,10 +577,12 @@ class MovieRecommender:
     #         return []
         
     def get_user_ratings(self, session, user_id):
-        ratings = session.query(Rating).filter(Rating.user_id == user_id).all()
+        with DB_SECONDS.time(query="get_user_ratings"):
+            ratings = session.query(Rating).filter(Rating.user_id == user_id).all()
+        DB_ROWS.inc(len(ratings), query="get_user_ratings")
         result = []
         for r in ratings:
-            title = self.movie_titles.get(r.movie_id)
+            title = self.catalog.title(r.movie_id)
             if title:
                 result.append({
                     "title": title,
@@ -359,40 +592,70 @@ class MovieRecommender:
         return result
 
 
+    # movie id for a client supplied movie, None if it is unknown
+    # Accepts:
+    # - movie id (int or numeric str)
+    # - dict with 'id' or 'movie_id' or 'title'
+    # - title string
+    def resolve_movie_id(self, movie):
+        movie_id = None
+
+        # dict payloads from the client
+        if isinstance(movie, dict):
+            if 'movie_id' in movie:
+                movie_id = int(movie['movie_id'])
+            elif 'id' in movie:
+                movie_id = int(movie['id'])
+            elif 'title' in movie:
+                movie_id = self.catalog.find_title(movie['title'])
+
+        # raw id (int or numeric str)
+        elif isinstance(movie, (int,)) or (isinstance(movie, str) and movie.isdigit()):
+            movie_id = int(movie)
+
+        # raw title string
+        else:
+            movie_id = self.catalog.find_title(movie)
+
+        if not movie_id or movie_id not in self.catalog:
+            return None
+        return movie_id
+
+
     def insert_rating(self, session, user_id, movie, value):
         """
         Accepts:
         - movie id (int or numeric str)
         - dict with 'id' or 'movie_id' or 'title'
         - title string
+        Returns True once saved, False when the movie is unknown.
         """
         try:
-            movie_id = None
-
-            # dict payloads from the client
-            if isinstance(movie, dict):
-                if 'movie_id' in movie:
-                    movie_id = int(movie['movie_id'])
-                elif 'id' in movie:
-                    movie_id = int(movie['id'])
-                elif 'title' in movie:
-                    movie_id = self.movie_inv_titles.get(normalize(movie['title']))
-
-            # raw id (int or numeric str)
-            elif isinstance(movie, (int,)) or (isinstance(movie, str) and movie.isdigit()):
-                movie_id = int(movie)
-
-            # raw title string
-            else:
-                movie_id = self.movie_inv_titles.get(normalize(movie))
-
-            if not movie_id or movie_id not in self.movie_ids:
-                print('insert_rating: unknown movie', movie)
+            movie_id = self.resolve_movie_id(movie)
+            if movie_id is None:
+                logger.info('insert_rating: unknown movie %r', movie)
                 return False
 
-            success = insert_rating_in_db(session, user_id, movie_id, value)
-            return success
+            insert_rating_in_db(session, user_id, movie_id, value)
+            return True
 
         except Exception as e:
             session.rollback()
             raise
+
+
+    # upsert many (movie, value) ratings for one user in bulk.
+    # returns (number saved, movies that could not be resolved)
+    def insert_ratings(self, session, user_id, ratings):
+        rows = {}
+        unknown = []
+        for movie, value in ratings:
+            movie_id = self.resolve_movie_id(movie)
+            if movie_id is None:
+                unknown.append(movie)
+                continue
+            # the last rating for a movie wins, like repeated single upserts
+            rows[movie_id] = {"user_id": user_id, "movie_id": movie_id, "value": value}
+
+        saved = upsert_ratings(session, list(rows.values())) if rows else 0
+        return saved, unknown
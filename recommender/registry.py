@@ -0,0 +1,204 @@
+import logging
+import os
+import threading
+import time
+import numpy as np
+from scipy.sparse import issparse
+from recommender.artifact import ARTIFACT_PATH, artifact_exists
+from recommender.db import SessionLocal
+from recommender.incremental import SimilarityUpdater
+from recommender.recommender import MovieRecommender
+from recommender import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReloadInProgress(Exception):
+    pass
+
+
+class ModelCheckFailed(Exception):
+    pass
+
+
+# sanity checks a freshly loaded model has to pass before it serves traffic
+def check_model(model):
+    if model.catalog is None or len(model.catalog) == 0:
+        raise ModelCheckFailed("empty movie catalog")
+    if model.neighbor_index is None or len(model.neighbor_index) == 0:
+        raise ModelCheckFailed("empty neighbor index")
+
+    # the most rated movie has to produce recommendations through the
+    # same path /recommend/batch uses. with NEIGHBORS_FROM_DB=request that
+    # path queries movie_similarities, so it gets a session of its own
+    top_id = int(model.movie_inv_mapper[int(np.argmax(model.supports))])
+    if not model.neighbor_index.topk(top_id, 5):
+        raise ModelCheckFailed(f"no neighbors for movie {top_id}")
+    session = SessionLocal()
+    try:
+        [(movie_ids, _)] = model.find_batch_recommended_movies(session, [[(top_id, 5.0)]], max_results=5)
+    finally:
+        session.close()
+    if not model.catalog.movies(movie_ids.tolist()):
+        raise ModelCheckFailed(f"no recommendations for movie {top_id}")
+
+
+# bytes held by the model's arrays and sparse matrices (one level deep).
+# memory-mapped artifact arrays are counted too, they live in the shared
+# page cache rather than in this process alone
+def model_bytes(model):
+    total = 0
+    for value in vars(model).values():
+        if isinstance(value, tuple):
+            values = value
+        elif hasattr(value, "__dict__") and not issparse(value):
+            values = vars(value).values()
+        else:
+            values = (value,)
+        for v in values:
+            if isinstance(v, np.ndarray):
+                total += v.nbytes
+            elif issparse(v):
+                total += sum(getattr(v, name).nbytes for name in ("data", "indices", "indptr") if hasattr(v, name))
+    return total
+
+
+# resident set size of this process, None where /proc isn't available
+def resident_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelRegistry:
+    """
+    Holds the MovieRecommender that serves requests.
+
+    current() hands out the active model; a handler keeps using the one it
+    got, so a reload never changes a model under an in-flight request.
+    reload() builds the next model off to the side, checks it and only then
+    swaps the reference, so a failed build leaves the old model serving.
+    update() does the same for incremental updates of the active model. Both
+    hold the reload lock, so one never swaps over the other's model.
+    """
+
+    def __init__(self, artifact_path=ARTIFACT_PATH):
+        self.artifact_path = artifact_path
+        self._active = None
+        self._info = {}
+        self._reload_lock = threading.Lock()
+        # incremental updater of the active model, made on the first update()
+        self._updater = None
+        self.reloading = False
+        self.updating = False
+        self.last_error = None
+
+    def current(self):
+        return self._active
+
+    # a reload or an incremental update holds the lock; another one would
+    # raise ReloadInProgress
+    @property
+    def busy(self):
+        return self._reload_lock.locked()
+
+    # build a model from the artifact if there is one, else from the CSVs
+    def _build(self):
+        if artifact_exists(self.artifact_path):
+            # map the prebuilt artifact from setup.py / build_artifact.py
+            return MovieRecommender(artifact_path=self.artifact_path), "artifact"
+        logger.info('No artifact at %s, building recommender from scratch', self.artifact_path)
+        return MovieRecommender(), "csv"
+
+    # blocking; run it in a thread. raises ReloadInProgress if another
+    # reload is running and ModelCheckFailed if the new model is unusable
+    def reload(self):
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadInProgress()
+        self.reloading = True
+        try:
+            started = time.time()
+            model, source = self._build()
+            check_model(model)
+            info = {
+                "version": model.build_version,
+                "source": source,
+                "engine": model.engine,
+                "loaded_at": time.time(),
+                "load_seconds": round(time.time() - started, 3),
+                "model_bytes": model_bytes(model),
+            }
+            # single reference assignment: requests see the old or the new model
+            self._active, self._info = model, info
+            self.last_error = None
+            logger.info('Loaded model %s', info["version"], extra={"source": source, "load_seconds": info["load_seconds"]})
+            return info
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.reloading = False
+            self._reload_lock.release()
+
+    # blocking; run it in a thread. applies live ratings since the active
+    # model's watermark (see SimilarityUpdater) to a copy of it, checks the
+    # copy and swaps it in. raises ReloadInProgress while a reload runs
+    def update(self):
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadInProgress()
+        self.updating = True
+        try:
+            model = self._active
+            # follow the active model when a reload swapped it
+            if self._updater is None or self._updater.recommender is not model:
+                self._updater = SimilarityUpdater(model)
+            summary = self._updater.update_once()
+            updated = self._updater.recommender
+            if updated is not model:
+                check_model(updated)
+                # single reference assignment, like reload
+                info = {**self._info, "version": updated.build_version, "model_bytes": model_bytes(updated)}
+                self._active, self._info = updated, info
+            return summary
+        except Exception:
+            # the updater may have moved past the active model, start over
+            self._updater = None
+            raise
+        finally:
+            self.updating = False
+            self._reload_lock.release()
+
+    def info(self):
+        model = self._active
+        info = dict(self._info)
+        if model is not None:
+            info["version"] = model.build_version
+            info["built_at"] = model.built_at
+        info.update({
+            "reloading": self.reloading,
+            "updating": self.updating,
+            "last_error": self.last_error,
+            "resident_bytes": resident_bytes(),
+        })
+        return info
+
+    # copies the serving model's sizes into the /metrics gauges; called per scrape
+    def export_metrics(self):
+        model = self._active
+        metrics.RESIDENT_BYTES.set(resident_bytes())
+        if model is None:
+            return
+        metrics.MODEL_INFO.clear()
+        metrics.MODEL_INFO.set(1, version=model.build_version, engine=model.engine)
+        metrics.MODEL_ITEMS.set(model.X_csc.shape[1])
+        metrics.MODEL_USERS.set(model.X_csc.shape[0])
+        metrics.MODEL_NNZ.set(model.X_csc.nnz)
+        metrics.MODEL_NEIGHBORS.set(len(model.neighbor_index.neighbor_ids))
+        metrics.MODEL_BUILT_AT.set(model.built_at)
+        metrics.MODEL_BYTES.set(self._info.get("model_bytes"))
+        for stat, value in model.long_tail_cache.stats().items():
+            if stat not in ("maxsize", "ttl"):
+                metrics.LONG_TAIL_CACHE.set(value, stat=stat)
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from recommender.cache import LRUCache
+from recommender.metrics import RESPONSE_CACHE
+from recommender.workers import run_db
+
+
+# /recommend results kept in this process: entries and seconds to live (0 = no expiry)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+# sqlite file shared by the uvicorn workers of one machine; unset = in-process only
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+# most rows kept in the shared file; older ones are pruned
+RESPONSE_CACHE_SHARED_SIZE = int(os.getenv("RESPONSE_CACHE_SHARED_SIZE", "100000"))
+# writes between prunes of the shared file
+PRUNE_EVERY = 1000
+
+
+# key for a seed list: (id, rating) pairs sorted by id with ratings bucketed
+# to half stars, so the same picks in any order hit the same entry. the model
+# version is part of the key: a reload or incremental update starts fresh
+def canonical_key(seeds, version, k):
+    pairs = sorted((int(movie_id), round(float(rating) * 2) / 2) for movie_id, rating in seeds)
+    raw = json.dumps([version, k, pairs], separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SQLiteBackend:
+    """
+    Shared key -> JSON value store in a sqlite file (WAL mode, so several
+    worker processes can read while one writes).
+    """
+
+    def __init__(self, path, maxsize=RESPONSE_CACHE_SHARED_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, created_at REAL NOT NULL)"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now):
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            "SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    """
+    Recommendation results by canonical seed set.
+
+    Lookups go to the in-process LRU first, then to the shared backend if
+    there is one. Concurrent misses for the same key are coalesced: the
+    first request starts the computation as a task of its own and every
+    request, that one included, waits on it (single-flight). The task runs to
+    completion and fills the cache even if all of them go away.
+    Only results passing cacheable (default: non-empty) are cached.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, backend=None):
+        self.local = LRUCache(maxsize, ttl or None)
+        self.backend = backend
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls):
+        backend = SQLiteBackend(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+        return cls(backend=backend)
+
+    # the cached value for key, else await compute() once for all callers
+    async def get_or_compute(self, key, compute, cacheable=bool):
+        value = self.local.get(key)
+        if value is not None:
+            RESPONSE_CACHE.inc(result="hit")
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            RESPONSE_CACHE.inc(result="coalesced")
+        else:
+            task = asyncio.ensure_future(self._load_or_compute(key, compute, cacheable))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        # shield: a cancelled caller (client gone, timeout) must not cancel
+        # the computation the other callers wait on
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # retrieved here so an error nobody waited for isn't reported
+        if not task.cancelled():
+            task.exception()
+
+    async def _load_or_compute(self, key, compute, cacheable):
+        if self.backend is not None:
+            value = await run_db(self.backend.get, key)
+            if value is not None:
+                RESPONSE_CACHE.inc(result="shared_hit")
+                self.local.set(key, value)
+                return value
+
+        RESPONSE_CACHE.inc(result="miss")
+        value = await compute()
+        if cacheable(value):
+            self.local.set(key, value)
+            if self.backend is not None:
+                await run_db(self.backend.set, key, value)
+        return value
+
+    def clear(self):
+        self.local.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        stats = self.local.stats()
+        stats["inflight"] = len(self._inflight)
+        stats["shared"] = self.backend.path if self.backend is not None else None
+        return stats
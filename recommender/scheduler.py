@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from recommender.metrics import ADMISSION, LONG_TAIL_PENDING
+from recommender.workers import run_cpu
+
+
+logger = logging.getLogger(__name__)
+
+# threads computing long-tail similarities (a scan of the seed's raters each)
+LONG_TAIL_WORKERS = int(os.getenv("LONG_TAIL_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+# long-tail computations queued or running at once; requests that would go
+# past this are answered from their high-support seeds right away
+LONG_TAIL_QUEUE = int(os.getenv("LONG_TAIL_QUEUE", "64"))
+# seconds an expensive request waits for its long-tail seeds before degrading
+LONG_TAIL_DEADLINE = float(os.getenv("LONG_TAIL_DEADLINE", "2.0"))
+# requests with at most this many uncached long-tail seeds run directly
+CHEAP_LONG_TAIL = int(os.getenv("CHEAP_LONG_TAIL", "0"))
+# neighbors per seed, k_per_seed of find_recommended_movies
+LONG_TAIL_K = 10
+
+
+class Scheduler:
+    """
+    Admission control in front of MovieRecommender.recommend_movies.
+
+    A request's cost is the number of its seeds that need a long-tail
+    computation. Cheap requests are scored right away. Expensive ones queue
+    those computations on a bounded pool (one per movie, shared by every
+    request waiting on it) and are scored once they're cached. When the queue
+    is full or the deadline passes, the request is scored with its
+    high-support seeds only and marked degraded; the queued computations
+    still finish and fill the cache for the next request.
+    """
+
+    def __init__(self, workers=LONG_TAIL_WORKERS, max_queue=LONG_TAIL_QUEUE,
+                 deadline=LONG_TAIL_DEADLINE, cheap=CHEAP_LONG_TAIL):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="long-tail")
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.cheap = cheap
+        # (build version, movie id) -> Future of the computation
+        self._pending = {}
+        # reentrant: a future that's already done runs its callback in submit
+        self._lock = threading.RLock()
+
+    # (movies, degraded) for the seeds
+    async def recommend(self, recommender, session, seeds, k):
+        long_tail = recommender.long_tail_cost([s.id for s in seeds], LONG_TAIL_K)
+        if len(long_tail) <= self.cheap:
+            ADMISSION.inc(cost="cheap", outcome="full")
+            return await run_cpu(recommender.recommend_movies, session, seeds, k), False
+
+        futures = self._submit(recommender, long_tail)
+        if futures is None:
+            ADMISSION.inc(cost="expensive", outcome="queue_full")
+            return await self._degraded(recommender, session, seeds, long_tail, k), True
+
+        try:
+            # shield: timing out must not cancel computations other requests share
+            await asyncio.wait_for(
+                asyncio.shield(asyncio.gather(*(asyncio.wrap_future(f) for f in futures))),
+                self.deadline,
+            )
+        except asyncio.TimeoutError:
+            ADMISSION.inc(cost="expensive", outcome="deadline")
+            return await self._degraded(recommender, session, seeds, long_tail, k), True
+        except Exception:
+            # let the request compute (and report) it itself
+            logger.exception('Long-tail warm-up failed')
+
+        ADMISSION.inc(cost="expensive", outcome="full")
+        return await run_cpu(recommender.recommend_movies, session, seeds, k), False
+
+    # futures for the movies' computations, reusing in-flight ones. None when
+    # the new ones don't fit in the queue
+    def _submit(self, recommender, movie_ids):
+        version = recommender.build_version
+        with self._lock:
+            new = [m for m in movie_ids if (version, m) not in self._pending]
+            if new and len(self._pending) + len(new) > self.max_queue:
+                return None
+            for movie_id in new:
+                key = (version, movie_id)
+                future = self.executor.submit(recommender.warm_long_tail, movie_id, LONG_TAIL_K)
+                self._pending[key] = future
+                future.add_done_callback(lambda f, key=key: self._done(key))
+            futures = [self._pending.get((version, m)) for m in movie_ids]
+            LONG_TAIL_PENDING.set(len(self._pending))
+        # a computation can finish (and leave _pending) before the lookup
+        return [f for f in futures if f is not None]
+
+    def _done(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+            LONG_TAIL_PENDING.set(len(self._pending))
+
+    async def _degraded(self, recommender, session, seeds, long_tail, k):
+        skip = set(long_tail)
+        seeds = [s for s in seeds if s.id not in skip]
+        if not seeds:
+            return []
+        return await run_cpu(recommender.recommend_movies, session, seeds, k)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "max_queue": self.max_queue, "deadline": self.deadline}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
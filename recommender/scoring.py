@@ -0,0 +1,89 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from recommender import encoding
+
+
+# sparse (n_items, n_items) matrix of the top-k neighbors of every indexed
+# movie, in utility matrix column space: S[i, j] = weighted_sim(i -> j)
+def neighbor_matrix(index, movie_mapper, n_items, k):
+    counts = np.diff(index.offsets)
+    # position of every entry inside its movie's list; keep the first k
+    rank = np.arange(len(index.neighbor_ids)) - np.repeat(index.offsets[:-1], counts)
+    keep = rank < k
+
+    rows = encoding.indices_of(movie_mapper, np.repeat(index.movie_ids, counts)[keep])
+    cols = encoding.indices_of(movie_mapper, index.neighbor_ids[keep])
+    sims = np.asarray(index.scores[keep], dtype=np.float64)
+
+    valid = (rows >= 0) & (cols >= 0)
+    return csr_matrix((sims[valid], (rows[valid], cols[valid])), shape=(n_items, n_items))
+
+
+# sparse rows for items missing from the neighbor matrix (obscure seeds),
+# built from {col: (neighbor_cols, sims)}
+def extra_rows(neighbors_by_col, n_items):
+    rows, cols, sims = [], [], []
+    for col, (n_cols, n_sims) in neighbors_by_col.items():
+        rows.append(np.full(len(n_cols), col, dtype=np.int64))
+        cols.append(np.asarray(n_cols, dtype=np.int64))
+        sims.append(np.asarray(n_sims, dtype=np.float64))
+    if not rows:
+        return csr_matrix((n_items, n_items))
+    return csr_matrix(
+        (np.concatenate(sims), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_items, n_items),
+    )
+
+
+# seed weights for one seed list: ratings centered on the list's mean, so
+# liked seeds pull their neighbors up and disliked ones push them down.
+# without any spread (a single seed, all the same rating) every seed counts
+# as liked
+def seed_weights(ratings):
+    ratings = np.asarray(ratings, dtype=np.float64)
+    if not len(ratings):
+        return ratings
+    weights = ratings - ratings.mean()
+    if np.allclose(weights, 0.0):
+        return np.ones(len(ratings))
+    return weights
+
+
+# (n_users, n_items) sparse matrix from per-user lists of (col, weight)
+def seed_matrix(seed_lists, n_items):
+    rows, cols, weights = [], [], []
+    for u, seeds in enumerate(seed_lists):
+        for col, weight in seeds:
+            rows.append(u)
+            cols.append(col)
+            weights.append(weight)
+    return csr_matrix(
+        (np.asarray(weights, dtype=np.float64), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+        shape=(len(seed_lists), n_items),
+    )
+
+
+# scores every user against every candidate in one sparse product, removes
+# the `exclude` entries (e.g. movies the user already rated) and returns the
+# best n (cols, scores) per user, highest score first. only positive scores
+# count: a candidate that mostly neighbors disliked seeds isn't recommended
+def top_n(seeds, S, exclude, n):
+    scores = (seeds @ S).tocsr()
+    if exclude is not None and exclude.nnz:
+        mask = exclude.astype(bool).astype(np.float64)
+        scores = (scores - scores.multiply(mask)).tocsr()
+    scores.eliminate_zeros()
+
+    results = []
+    for u in range(scores.shape[0]):
+        start, stop = scores.indptr[u], scores.indptr[u + 1]
+        cols = scores.indices[start:stop]
+        vals = scores.data[start:stop]
+        positive = vals > 0
+        cols, vals = cols[positive], vals[positive]
+        if n < len(vals):
+            top = np.argpartition(-vals, n - 1)[:n]
+            cols, vals = cols[top], vals[top]
+        order = np.argsort(-vals, kind="stable")
+        results.append((cols[order], vals[order]))
+    return results
@@ -0,0 +1,158 @@
+from bisect import bisect_left
+import numpy as np
+from recommender.helpers import normalize
+
+
+NGRAM = 3
+# minimum Dice overlap of title n-grams for a fuzzy (typo) match
+MIN_SIMILARITY = 0.35
+# how much popularity can lift a match: score * (1 + POPULARITY_WEIGHT * pop)
+POPULARITY_WEIGHT = 0.5
+# bonus for titles where a word starts with the query (search-as-you-type)
+PREFIX_BONUS = 1.0
+# bonus on top of that when the whole normalized title equals the query
+EXACT_BONUS = 1.0
+# longest query prefix with a precomputed, popularity-ordered result list.
+# one or two characters match a large part of the catalog, so those
+# answers are built once instead of ranked per keystroke
+SHORT_PREFIX = 2
+SHORT_RESULTS = 100
+# leading articles that the catalog moves to the end of the title
+ARTICLES = {"the", "a", "an"}
+
+
+def ngrams(s, n=NGRAM):
+    s = f" {s} "
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+
+class TitleSearch:
+    """
+    Prefix + fuzzy title search over the catalog.
+
+    - prefix index: every word-start suffix of every normalized title, sorted,
+      so "matrix" finds "Matrix, The" and "star w" finds "Star Wars: ..."
+    - n-gram index: CSR postings from character trigram to title rows, ranked
+      by Dice overlap, so "shawshenk" still finds "Shawshank Redemption"
+
+    Scores are weighted by popularity (rating counts).
+    """
+
+    # titles are already normalized (helpers.normalize), e.g. Catalog.normalized
+    def __init__(self, movie_ids, titles, popularity=None):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.norm = list(titles)
+        self.exact = {title: row for row, title in enumerate(self.norm)}
+        n = len(self.norm)
+
+        if popularity is None:
+            popularity = np.zeros(n)
+        pop = np.log1p(np.asarray(popularity, dtype=np.float64))
+        # popularity multiplier in [1, 1 + POPULARITY_WEIGHT]
+        self.boost = 1.0 + POPULARITY_WEIGHT * (pop / pop.max() if n and pop.max() > 0 else pop)
+
+        self._build_prefix_index()
+        self._build_ngram_index()
+        self._build_short_prefixes()
+
+    def __len__(self):
+        return len(self.norm)
+
+    def _build_prefix_index(self):
+        keys, rows = [], []
+        for row, title in enumerate(self.norm):
+            start = 0
+            while True:
+                keys.append(title[start:])
+                rows.append(row)
+                start = title.find(" ", start) + 1
+                if start == 0:
+                    break
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.prefix_keys = [keys[i] for i in order]
+        self.prefix_rows = np.asarray(rows, dtype=np.int32)[order]
+
+    def _build_ngram_index(self):
+        vocab = {}
+        gram_ids, rows = [], []
+        self.gram_counts = np.zeros(len(self.norm), dtype=np.int32)
+        for row, title in enumerate(self.norm):
+            grams = ngrams(title)
+            self.gram_counts[row] = len(grams)
+            for g in grams:
+                gram_ids.append(vocab.setdefault(g, len(vocab)))
+                rows.append(row)
+        gram_ids = np.asarray(gram_ids, dtype=np.int32)
+        rows = np.asarray(rows, dtype=np.int32)
+
+        order = np.argsort(gram_ids, kind="stable")
+        self.vocab = vocab
+        self.postings = rows[order]
+        self.posting_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(vocab)), out=self.posting_offsets[1:])
+
+    def _build_short_prefixes(self):
+        # every distinct 1..SHORT_PREFIX character prefix, top results by popularity
+        self.short = {}
+        prefixes = {key[:k] for key in self.prefix_keys for k in range(1, SHORT_PREFIX + 1) if len(key) >= k}
+        for p in prefixes:
+            rows = np.unique(self._prefix_rows(p))
+            self.short[p] = self._rank(rows, PREFIX_BONUS, SHORT_RESULTS)
+
+    # rows whose title has a word starting with q. a title can show up
+    # more than once (several matching words)
+    def _prefix_rows(self, q):
+        lo = bisect_left(self.prefix_keys, q)
+        # normalized titles only hold [a-z0-9 ], all below "~"
+        hi = bisect_left(self.prefix_keys, q + "~", lo)
+        return self.prefix_rows[lo:hi]
+
+    # number of n-grams every row shares with the query
+    def _shared_ngrams(self, grams):
+        ids = [self.vocab[g] for g in grams if g in self.vocab]
+        if not ids:
+            return np.zeros(len(self.norm), dtype=np.int64)
+        postings = np.concatenate([
+            self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]] for i in ids
+        ])
+        return np.bincount(postings, minlength=len(self.norm))
+
+    def _rank(self, rows, text_scores, limit):
+        scores = text_scores * self.boost[rows]
+        if limit < len(rows):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    # best `limit` (movie_ids, scores) for a free-text query, best first
+    def search(self, query, limit=10):
+        q = normalize(query)
+        if not q or limit <= 0:
+            return self.movie_ids[:0], np.zeros(0)
+
+        if len(q) <= SHORT_PREFIX and q in self.short:
+            rows, scores = self.short[q]
+            return self.movie_ids[rows[:limit]], scores[:limit]
+
+        # text score per row: Dice overlap of n-grams (dropped below
+        # MIN_SIMILARITY), raised for prefix and exact hits
+        grams = ngrams(q)
+        text = 2.0 * self._shared_ngrams(grams) / (len(grams) + self.gram_counts)
+        text[text < MIN_SIMILARITY] = 0.0
+        # MovieLens stores "The Dark Knight" as "Dark Knight, The"
+        forms = [q]
+        article, _, rest = q.partition(" ")
+        if article in ARTICLES and rest:
+            forms.append(f"{rest} {article}")
+
+        for form in forms:
+            # fancy-index += applies once per row even when rows repeat
+            text[self._prefix_rows(form)] += PREFIX_BONUS
+            exact = self.exact.get(form)
+            if exact is not None:
+                text[exact] += EXACT_BONUS
+
+        candidates = np.flatnonzero(text)
+        rows, scores = self._rank(candidates, text[candidates], limit)
+        return self.movie_ids[rows], scores
@@ -0,0 +1,121 @@
+import numpy as np
+from scipy.sparse import diags
+
+
+# neighbors kept per item, shrinkage for few co-ratings, and how many of the
+# most rated items count as high support (calculate_similarities and the
+# incremental updater have to agree on these)
+K_NEIGHBORS = 10
+SHRINK_ALPHA = 10
+HIGH_SUPPORT_TOP_N = 10000
+
+
+# number of users who rated each item, straight from the CSC column pointers
+def support_counts(X_csc):
+    return np.diff(X_csc.indptr).astype(np.int64)
+
+
+# column indices of the top_n most supported items.
+# stable sort so ties keep column order, same as sorted(..., reverse=True)
+def top_support_items(supports, top_n):
+    order = np.argsort(-supports, kind="stable")
+    return order[:top_n]
+
+
+# binarized copy of the utility matrix: 1 wherever a user rated an item
+def binarize(X):
+    B = X.copy()
+    B.data = np.ones_like(B.data, dtype=np.float32)
+    return B
+
+
+# co-rating counts for each (rows[p], cols[p]) item pair.
+# rows of B.T are gathered for both sides of every pair and multiplied
+# elementwise, so the only work done is on the users of the paired items.
+# pairs are processed in chunks so at most ~max_nnz entries are live at once.
+def co_counts(X_csc, rows, cols, max_nnz=50_000_000):
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    out = np.zeros(len(rows), dtype=np.int64)
+    if len(rows) == 0:
+        return out
+
+    B_items = binarize(X_csc).T.tocsr()  # shape = (n_items, n_users)
+    supports = np.diff(B_items.indptr)
+
+    # cumulative nnz of the anchor side decides where each chunk ends
+    cost = np.cumsum(supports[rows] + supports[cols])
+    start = 0
+    while start < len(rows):
+        limit = (cost[start - 1] if start else 0) + max_nnz
+        stop = max(int(np.searchsorted(cost, limit, side="right")), start + 1)
+        left = B_items[rows[start:stop]]
+        right = B_items[cols[start:stop]]
+        out[start:stop] = np.asarray(left.multiply(right).sum(axis=1)).ravel()
+        start = stop
+    return out
+
+
+# flatten the kNN output into (anchor, neighbor, raw_sim) column pairs.
+# rank 0 is the item itself; both ends have to be in item_mask and each
+# unordered pair is kept once, as (smaller movie id, larger movie id).
+def knn_pairs(distances, indices, item_mask, movie_inv_mapper):
+    n_items, width = indices.shape
+    rows = np.repeat(np.arange(n_items), width - 1)
+    cols = indices[:, 1:].ravel()
+    raw = 1.0 - distances[:, 1:].ravel()
+
+    keep = item_mask[rows] & item_mask[cols]
+    keep &= movie_inv_mapper[rows] < movie_inv_mapper[cols]
+    return rows[keep], cols[keep], raw[keep]
+
+
+# damp similarities backed by few co-ratings: sim * n / (n + alpha)
+def shrink(raw_sims, co_cnts, alpha):
+    co_cnts = np.asarray(co_cnts, dtype=np.float64)
+    return raw_sims * (co_cnts / (co_cnts + alpha))
+
+
+class LongTailScorer:
+    """
+    Similarities between any movie and the high support movies.
+    The high support columns are L2-normalized once, so scoring a movie is
+    a single sparse row gather plus one product, instead of one dense
+    cosine per high support movie.
+    """
+
+    def __init__(self, X_csc, high_support_cols, item_ids, alpha=SHRINK_ALPHA):
+        self.alpha = alpha
+        self.X_csc = X_csc
+        self.cols = np.asarray(high_support_cols, dtype=np.int64)
+        self.ids = np.asarray(item_ids)[self.cols]
+
+        X_hs = X_csc[:, self.cols].astype(np.float64)
+        norms = np.sqrt(np.asarray(X_hs.multiply(X_hs).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        # shape = (n_users, n_high_support), rows sliced per request
+        self.X_norm = (X_hs @ diags(1.0 / norms)).tocsr()
+
+    # (neighbor movie ids, weighted sims) for item column col, best first.
+    # high support movies with no co-ratings are left out.
+    def score(self, col, k=None):
+        start, stop = self.X_csc.indptr[col], self.X_csc.indptr[col + 1]
+        users = self.X_csc.indices[start:stop]
+        values = np.asarray(self.X_csc.data[start:stop], dtype=np.float64)
+        norm = np.sqrt(values @ values)
+        if len(users) == 0 or norm == 0:
+            return self.ids[:0], np.zeros(0)
+
+        sub = self.X_norm[users]  # only the users who rated this movie
+        raw_sims = (sub.T @ values) / norm
+        # every stored entry of sub is one co-rating
+        co_cnts = np.bincount(sub.indices, minlength=sub.shape[1])
+
+        candidates = np.flatnonzero(co_cnts)
+        w_sims = shrink(raw_sims[candidates], co_cnts[candidates], self.alpha)
+
+        if k is not None and k < len(candidates):
+            top = np.argpartition(-w_sims, k - 1)[:k]
+            candidates, w_sims = candidates[top], w_sims[top]
+        order = np.argsort(-w_sims, kind="stable")
+        return self.ids[candidates[order]], w_sims[order]
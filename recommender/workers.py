@@ -0,0 +1,53 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+# threads for blocking database work (sessions, queries, commits)
+DB_THREADS = int(os.getenv("DB_THREADS", "8"))
+# threads for recommender scoring. numpy/scipy release the GIL in the heavy
+# parts, and every thread shares the one in-memory model.
+CPU_THREADS = int(os.getenv("CPU_THREADS", str(os.cpu_count() or 1)))
+# scoring calls allowed in flight at once; callers past this wait on the
+# event loop instead of piling up in the executor queue
+CPU_CONCURRENCY = int(os.getenv("CPU_CONCURRENCY", str(CPU_THREADS)))
+
+db_executor = ThreadPoolExecutor(DB_THREADS, thread_name_prefix="db")
+cpu_executor = ThreadPoolExecutor(CPU_THREADS, thread_name_prefix="cpu")
+
+_cpu_slots = None
+
+
+def _slots():
+    # created lazily so it binds to the running event loop
+    global _cpu_slots
+    if _cpu_slots is None:
+        _cpu_slots = asyncio.Semaphore(CPU_CONCURRENCY)
+    return _cpu_slots
+
+
+async def _run(executor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # carry context vars (e.g. the request id) into the worker thread
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+# run a blocking DB call off the event loop
+async def run_db(fn, *args, **kwargs):
+    return await _run(db_executor, fn, *args, **kwargs)
+
+
+# run CPU-heavy recommender work off the event loop, at most
+# CPU_CONCURRENCY at a time
+async def run_cpu(fn, *args, **kwargs):
+    async with _slots():
+        return await _run(cpu_executor, fn, *args, **kwargs)
+
+
+def shutdown():
+    db_executor.shutdown(wait=False, cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
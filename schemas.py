@@ -24,6 +24,14 @@ class Seeds(BaseModel):
     seeds: list[Seed]
 
 
+class SeedsBatch(BaseModel):
+    batch: list[Seeds]
+
+
 class RatingRequest(BaseModel):
     movie: str
-    value: int
\ No newline at end of file
+    value: int
+
+
+class BulkRatingRequest(BaseModel):
+    ratings: list[RatingRequest]
\ No newline at end of file
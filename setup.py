@@ -1,6 +1,8 @@
 from recommender.db import get_db, insert_all_similarities
 from recommender.recommender import MovieRecommender
+from recommender.artifact import ARTIFACT_PATH
 import os
+from recommender.log import setup_logging
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -23,11 +25,13 @@ def main():
 
     try:
         # recommender.import_ratings()
-        print('Calculating similarities')
-        anchor_ids, neighbor_ids, weighted_sims = recommender.calculate_similarities()
+        # similarities were already calculated while building the recommender
+        anchor_ids, neighbor_ids, weighted_sims = recommender.similarities
         print('Saving Similarities')
         insert_all_similarities(session, anchor_ids, neighbor_ids, weighted_sims)
         session.commit()
+        print(f'Writing artifact to {ARTIFACT_PATH}')
+        recommender.save_artifact(ARTIFACT_PATH)
     except:
         print('Exception')
         session.rollback()
@@ -36,4 +40,5 @@ def main():
         session.close()
 
 if __name__ == "__main__":
+    setup_logging()
     main()
\ No newline at end of file
@@ -6,17 +6,17 @@ from recommender.helpers import normalize
 
 
 seeds = [
-    Seed(title='Toy Story (1995)', rating=5.0),
-    Seed(title='Inception (2010)', rating=5.0),
-    Seed(title='Jumanji (1995)', rating=5.0),
-    Seed(title='Star Wars: Episode IV - A New Hope (1977)', rating=1.0),
-    Seed(title='Black Beauty (1994)', rating=1.0),
-    Seed(title='Die Hard (1988)', rating=1.0),
-    Seed(title='Ring, The (2002)', rating=1.0),
-    Seed(title='Antz (1998)', rating=5.0),
-    Seed(title='Star Wars: Episode I - The Phantom Menace (1999)', rating=5.0),
-    Seed(title="Ferris Bueller's Day Off (1986)", rating=5.0),
-    Seed(title='Star Wars: Episode II - Attack of the Clones (2002)', rating = 1.0)
+    Seed(id=1, rating=5.0),  # Toy Story (1995)
+    Seed(id=79132, rating=5.0),  # Inception (2010)
+    Seed(id=2, rating=5.0),  # Jumanji (1995)
+    Seed(id=260, rating=1.0),  # Star Wars: Episode IV - A New Hope (1977)
+    Seed(id=421, rating=1.0),  # Black Beauty (1994)
+    Seed(id=1036, rating=1.0),  # Die Hard (1988)
+    Seed(id=5679, rating=1.0),  # Ring, The (2002)
+    Seed(id=2294, rating=5.0),  # Antz (1998)
+    Seed(id=2628, rating=5.0),  # Star Wars: Episode I - The Phantom Menace (1999)
+    Seed(id=2918, rating=5.0),  # Ferris Bueller's Day Off (1986)
+    Seed(id=5378, rating=1.0),  # Star Wars: Episode II - Attack of the Clones (2002)
 ]
 
 
@@ -0,0 +1,37 @@
+# folds live ratings written since the artifact was built into the artifact
+# and movie_similarities, without rebuilding from the MovieLens CSV.
+# run it periodically (cron) or set SIMILARITY_UPDATE_INTERVAL for app.py.
+from recommender.artifact import ARTIFACT_PATH, artifact_exists
+from recommender.db import get_db
+from recommender.incremental import SimilarityUpdater
+from recommender.recommender import MovieRecommender
+from recommender.log import setup_logging
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def main():
+    if not artifact_exists(ARTIFACT_PATH):
+        raise SystemExit(f'No artifact at {ARTIFACT_PATH}, run build_artifact.py or setup.py first')
+    recommender = MovieRecommender(artifact_path=ARTIFACT_PATH)
+    updater = SimilarityUpdater(recommender)
+
+    session = next(get_db())
+    try:
+        summary = updater.update(session)
+        print('Applied', summary)
+        if summary["ratings"]:
+            # the new watermark goes with the artifact
+            manifest = updater.recommender.save_artifact(ARTIFACT_PATH)
+            print('Wrote artifact', manifest["build_version"])
+    except:
+        print('Exception')
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()